@@ -1,33 +1,339 @@
 import argparse
+import asyncio
+import json
 import os
-import torch
-import torchaudio
-import librosa
+import sys
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 import numpy as np
-import uuid
-import subprocess
+from audio_io import float_to_pcm16, get_duration, iter_audio_blocks, load_audio
+from jsonl import iter_jsonl, open_jsonl_for_append
+from vad import VAD
+
+# All backends take 16 kHz mono audio
+SAMPLING_RATE = 16000
+
+# Long-form mode: model window and the context trimmed from each side of a strided window
+LONG_FORM_WINDOW_SECONDS = 30.0
+LONG_FORM_STRIDE_SECONDS = 5.0
+
+# Audio fed to a Vosk recognizer per call (0.2 s), so partial results come out while decoding
+VOSK_BLOCK_SAMPLES = 3200
+
+# Hugging Face / SpeechBrain checkpoints used by each backend (a model language for Vosk).
+# torch and the backend libraries are only imported once a backend is used, so
+# --help, argument errors and the Vosk path start without paying for them.
+MODEL_SOURCES = {
+    "wav2vec_v3": "m3hrdadfi/wav2vec2-large-xlsr-persian-v3",
+    "wav2vec_fa": "masoudmzb/wav2vec2-xlsr-multilingual-53-fa",
+    "hezar": "hezarai/whisper-small-fa",
+    "vosk": "fa",
+    "whisper": "speechbrain/asr-whisper-large-v2-commonvoice-fa",
+}
+
+# Where the ONNX variants of wav2vec models are exported to on first use
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "speech_dataset", "onnx")
 
 def parse_args():
     parser = argparse.ArgumentParser(description="ASR transcription tool.")
-    parser.add_argument("audio_file", help="Path to the audio file.")
-    parser.add_argument(
+    parser.add_argument("input_path", help="Path to a WAV file or a directory of WAV files.")
+    models = parser.add_mutually_exclusive_group(required=True)
+    models.add_argument(
         "--model", 
-        choices=["wav2vec_v3", "wav2vec_fa", "hezar", "vosk", "whisper"], 
-        required=True, 
+        choices=list(BACKENDS), 
         help="Choose the ASR model to use."
     )
-    return parser.parse_args()
+    models.add_argument(
+        "--ensemble",
+        nargs="+",
+        choices=list(BACKENDS),
+        help="Run several models on each file, decoded once, and keep the hypothesis they agree with most."
+    )
+    parser.add_argument(
+        "--max-loaded-models",
+        type=int,
+        default=2,
+        help="Maximum number of ASR models kept in memory at once."
+    )
+    parser.add_argument(
+        "--max-model-memory-gb",
+        type=float,
+        default=None,
+        help="Evict least recently used models once resident weights exceed this size."
+    )
+    parser.add_argument(
+        "--batch-seconds",
+        type=float,
+        default=None,
+        help="Batch wav2vec models over a directory, capping each batch at this much padded audio."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of files in a directory transcribed concurrently."
+    )
+    parser.add_argument(
+        "--vosk-server",
+        default=None,
+        help="Send Vosk requests to a running vosk-server at this websocket URL, e.g. ws://localhost:2700."
+    )
+    parser.add_argument(
+        "--long-form",
+        choices=["vad", "strided"],
+        default=None,
+        help="Cut long recordings into model-sized pieces, at VAD speech segments or in overlapping windows."
+    )
+    parser.add_argument(
+        "--window-seconds",
+        type=float,
+        default=LONG_FORM_WINDOW_SECONDS,
+        help="Longest piece of audio passed to the model in long-form mode."
+    )
+    parser.add_argument(
+        "--stride-seconds",
+        type=float,
+        default=LONG_FORM_STRIDE_SECONDS,
+        help="Context on each side of a strided window whose output is dropped."
+    )
+    parser.add_argument(
+        "--source-cache-dir",
+        default=None,
+        help="In VAD long-form mode, keep decoded recordings here and read them memory-mapped instead of in memory."
+    )
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="Append a NeMo-style JSON line per file to this manifest, skipping files already in it."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of CPU threads used by torch (and ONNX Runtime) for inference."
+    )
+    parser.add_argument(
+        "--accuracy-check",
+        action="store_true",
+        help="Treat input_path as a manifest with reference 'text' and compare the WER and speed of a "
+             "-int8/-onnx model with its full-precision model."
+    )
+    parser.add_argument(
+        "--max-wer-delta",
+        type=float,
+        default=None,
+        help="With --accuracy-check, fail when the variant's WER exceeds the full-precision WER by more than this."
+    )
+    args = parser.parse_args()
+    if args.accuracy_check and (not args.model or get_backend(args.model).variant_of is None):
+        parser.error("--accuracy-check requires --model with a -int8 or -onnx model")
+    return args
+
+def get_device():
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda:0"
+    warnings.warn(
+        "CUDA is not available, running full-precision models on CPU. "
+        "The -int8 and -onnx wav2vec models are optimized for CPU."
+    )
+    return "cpu"
+
+# Model loaders, called once per backend by the ModelRegistry
+def load_wav2vec(source, optimize=None):
+    """Load a wav2vec2 processor and CTC model.
+
+    ``optimize="int8"`` quantizes the linear layers to int8 for CPU inference
+    and ``optimize="onnx"`` runs an ONNX export on ONNX Runtime; both stay on CPU.
+    """
+    from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+    processor = Wav2Vec2Processor.from_pretrained(source)
+    model = Wav2Vec2ForCTC.from_pretrained(source)
+    if optimize == "int8":
+        model = quantize_wav2vec(model)
+    elif optimize == "onnx":
+        model = OnnxWav2Vec2(export_wav2vec_onnx(model, source), model.config)
+    else:
+        model = model.to(get_device())
+    model.eval()
+    return processor, model
+
+def quantize_wav2vec(model):
+    """Dynamically quantize the linear layers (attention and feed-forward) to int8 on CPU."""
+    import torch
+
+    model = model.cpu().eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def export_wav2vec_onnx(model, source):
+    """Export a Wav2Vec2ForCTC to ONNX_CACHE_DIR once, with dynamic batch and length axes."""
+    import torch
+
+    onnx_path = os.path.join(ONNX_CACHE_DIR, source.replace("/", "--") + ".onnx")
+    if os.path.exists(onnx_path):
+        return onnx_path
+    os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+    partial_path = f"{onnx_path}.partial"
+    dummy_input = torch.zeros(1, SAMPLING_RATE, dtype=torch.float32)
+    dummy_mask = torch.ones(1, SAMPLING_RATE, dtype=torch.long)
+    with torch.no_grad():
+        torch.onnx.export(
+            model.cpu().eval(), (dummy_input, dummy_mask), partial_path,
+            input_names=["input_values", "attention_mask"], output_names=["logits"],
+            dynamic_axes={
+                "input_values": {0: "batch", 1: "samples"},
+                "attention_mask": {0: "batch", 1: "samples"},
+                "logits": {0: "batch", 1: "frames"}
+            },
+            opset_version=14
+        )
+    os.replace(partial_path, onnx_path)
+    return onnx_path
+
+class OnnxWav2Vec2:
+    """An exported Wav2Vec2ForCTC on ONNX Runtime, called like the torch model.
+
+    Takes torch tensors and returns an object with ``.logits``, so the wav2vec
+    functions above work unchanged. Uses as many threads as torch.
+    """
 
-# Helper function for resampling audio
+    def __init__(self, onnx_path, config):
+        import onnxruntime
+        import torch
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(onnx_path, sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+        self.config = config
+        self.device = torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_values, attention_mask=None):
+        import torch
+
+        if attention_mask is None:
+            attention_mask = torch.ones(input_values.shape, dtype=torch.long)
+        logits, = self.session.run(["logits"], {
+            "input_values": input_values.numpy(),
+            "attention_mask": attention_mask.numpy().astype(np.int64)
+        })
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+def load_hezar(source):
+    from hezar.models import Model as HezarModel
+
+    return HezarModel.load(source).to(get_device())
+
+def load_whisper(source):
+    from speechbrain.inference.ASR import WhisperASR
+
+    return WhisperASR.from_hparams(source=source, run_opts={"device": get_device()})
+
+def load_vosk(lang):
+    from vosk import Model as VoskModel
+
+    return VoskModel(lang=lang)
+
+def model_nbytes(model):
+    """Approximate resident size of a loaded model (parameters and buffers)."""
+    # A model with torch weights has imported torch already
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return 0
+    modules = model if isinstance(model, tuple) else (model,)
+    total = 0
+    for module in modules:
+        if isinstance(module, torch.nn.Module):
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+class ModelRegistry:
+    """Loads each ASR backend once and keeps it resident between files.
+
+    Models are evicted least recently used first, when more than ``max_models``
+    are loaded or when their weights exceed ``max_memory_gb``.
+    """
+
+    def __init__(self, max_models=2, max_memory_gb=None):
+        self.max_models = max(1, max_models)
+        self.max_memory_bytes = None if max_memory_gb is None else int(max_memory_gb * 1024 ** 3)
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name):
+        """Return the loaded model for ``model_name``, loading it on first use."""
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+                return self._models[model_name]
+
+            backend = get_backend(model_name)
+
+            # Make room before loading so peak memory stays within the limit
+            while len(self._models) >= self.max_models:
+                self._evict_oldest()
+
+            model = backend.load(backend.source)
+            self._models[model_name] = model
+            self._sizes[model_name] = model_nbytes(model)
+
+            if self.max_memory_bytes is not None:
+                while len(self._models) > 1 and sum(self._sizes.values()) > self.max_memory_bytes:
+                    self._evict_oldest()
+            return model
+
+    def evict(self, model_name):
+        """Drop a loaded model so its memory can be reclaimed."""
+        with self._lock:
+            self._evict(model_name)
+
+    def clear(self):
+        with self._lock:
+            for model_name in list(self._models):
+                self._evict(model_name)
+
+    def loaded_models(self):
+        return list(self._models)
+
+    def _evict_oldest(self):
+        self._evict(next(iter(self._models)))
+
+    def _evict(self, model_name):
+        self._models.pop(model_name, None)
+        self._sizes.pop(model_name, None)
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+# Registry shared by transcribe_file calls that don't pass their own
+default_registry = ModelRegistry()
+
+# Helper function for loading audio: decoded, downmixed to mono and resampled in one ffmpeg pass
 def load_and_resample_audio(path, processor):
-    speech_array, sampling_rate = torchaudio.load(path)
-    speech_array = speech_array.squeeze().numpy()
-    return librosa.resample(np.asarray(speech_array), orig_sr=sampling_rate, target_sr=processor.feature_extractor.sampling_rate)
+    speech, _ = load_audio(path, processor.feature_extractor.sampling_rate, channels=1)
+    return speech
 
 # Wav2Vec2 model transcription
 def wav2vec_transcript(audio_file_path, processor, model):
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     speech = load_and_resample_audio(audio_file_path, processor)
+    return wav2vec_transcribe_array(speech, processor, model)
+
+def wav2vec_transcribe_array(speech, processor, model):
+    """Transcribe mono audio already at the processor's sampling rate."""
+    import torch
+
+    device = model.device
     features = processor(speech, sampling_rate=processor.feature_extractor.sampling_rate, return_tensors="pt", padding=True)
     input_values, attention_mask = features.input_values.to(device), features.attention_mask.to(device)
 
@@ -36,92 +342,845 @@ def wav2vec_transcript(audio_file_path, processor, model):
     pred_ids = torch.argmax(logits, dim=-1)
     return processor.batch_decode(pred_ids)[0]
 
-# Hezar transcription
-def hezar_transcript(audio_file_path):
-    from hezar.models import Model as HezarModel
+def make_duration_batches(durations, max_batch_seconds):
+    """Group indices by ascending duration so each batch's padded audio stays under the cap.
+
+    A batch costs ``len(batch) * longest_duration`` seconds once padded. Sorting
+    first keeps similar lengths together, so little of that is padding. A single
+    clip longer than the cap still gets a batch of its own.
+    """
+    order = sorted(range(len(durations)), key=durations.__getitem__)
+    batches, batch = [], []
+    for idx in order:
+        # Durations are ascending, so the new clip sets the padded length
+        if batch and durations[idx] * (len(batch) + 1) > max_batch_seconds:
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def wav2vec_batch_transcripts(audio_file_paths, processor, model, max_batch_seconds=120.0, with_timings=False):
+    """Transcribe many files with batched wav2vec2 forward passes.
+
+    Yields ``(audio_file_path, transcript)`` pairs batch by batch, in order of
+    increasing duration. Only one batch of audio is held in memory at a time.
+    With ``with_timings``, a third item gives the file's duration and its share
+    of the batch's decode and inference time (split by duration).
+    """
+    import torch
+
+    durations = [get_duration(path) for path in audio_file_paths]
 
-    model = HezarModel.load("hezarai/whisper-small-fa").to("cuda:0" if torch.cuda.is_available() else "cpu")
+    for batch in make_duration_batches(durations, max_batch_seconds):
+        batch_paths = [audio_file_paths[idx] for idx in batch]
+        start_time = time.perf_counter()
+        speeches = [load_and_resample_audio(path, processor) for path in batch_paths]
+        decode_ms = elapsed_ms(start_time)
+        start_time = time.perf_counter()
+        pred_ids = torch.argmax(wav2vec_batch_logits(speeches, processor, model), dim=-1)
+        transcripts = processor.batch_decode(pred_ids)
+        inference_ms = elapsed_ms(start_time)
+        if not with_timings:
+            yield from zip(batch_paths, transcripts)
+            continue
+
+        batch_duration = sum(durations[idx] for idx in batch) or 1.0
+        for idx, audio_path, transcript in zip(batch, batch_paths, transcripts):
+            share = durations[idx] / batch_duration
+            yield audio_path, transcript, {
+                "duration": durations[idx],
+                "decode_ms": decode_ms * share,
+                "inference_ms": inference_ms * share
+            }
+
+def wav2vec_batch_logits(speeches, processor, model):
+    """CTC logits of a zero-padded batch of mono arrays, as a (batch, frames, vocab) tensor."""
+    import torch
+
+    device = model.device
+    sampling_rate = processor.feature_extractor.sampling_rate
+    features = processor(speeches, sampling_rate=sampling_rate, return_tensors="pt", padding=True)
+    input_values = features.input_values.to(device)
+    attention_mask = features.get("attention_mask")
+    if attention_mask is not None:
+        attention_mask = attention_mask.to(device)
+
+    with torch.no_grad():
+        return model(input_values, attention_mask=attention_mask).logits.cpu()
+
+# Hezar transcription
+def hezar_transcript(audio_file_path, model=None):
+    if model is None:
+        model = load_hezar(MODEL_SOURCES["hezar"])
     transcript = model.predict(audio_file_path)
     return transcript[0]['text'].strip()
 
+def hezar_transcribe_array(speech, model):
+    transcript = model.predict(speech)
+    return transcript[0]['text'].strip()
+
 # Vosk transcription
-def vosk_transcript(audio_file_path):
-    """Transcribe audio using the Vosk CLI command."""
-    output_txt_path = f"{uuid.uuid4()}.txt"  # Temporary output file
-    try:
-        # Run the Vosk CLI command
-        subprocess.run(
-            ["vosk", "-l", "fa", "-i", audio_file_path, "-o", output_txt_path],
-            check=True,
-        )
+def vosk_transcribe_blocks(blocks, model):
+    """Stream mono 16 kHz float blocks through a recognizer on the in-process Vosk model.
 
-        # Read the transcription from the output file
-        with open(output_txt_path, "r", encoding="utf-8") as f:
-            transcript = f.read().strip()
+    The model is shared; each call gets its own recognizer, so several threads
+    can decode at once.
+    """
+    from vosk import KaldiRecognizer
 
+    recognizer = KaldiRecognizer(model, SAMPLING_RATE)
+    texts = []
+    for block in blocks:
+        for start in range(0, len(block), VOSK_BLOCK_SAMPLES):
+            pcm = float_to_pcm16(block[start:start + VOSK_BLOCK_SAMPLES]).tobytes()
+            if recognizer.AcceptWaveform(pcm):
+                texts.append(json.loads(recognizer.Result())["text"])
+    texts.append(json.loads(recognizer.FinalResult())["text"])
+    return " ".join(text for text in texts if text)
+
+def vosk_transcript(audio_file_path, model=None):
+    """Transcribe a file with Vosk, decoding it with ffmpeg while it is recognized."""
+    if model is None:
+        model = load_vosk(MODEL_SOURCES["vosk"])
+    blocks = (block[0] for block in iter_audio_blocks(audio_file_path, 10 * SAMPLING_RATE, SAMPLING_RATE))
+    return vosk_transcribe_blocks(blocks, model)
+
+async def vosk_server_transcript(audio_file_path, server_url):
+    """Transcribe a file on a vosk-server over its websocket protocol."""
+    import websockets
+
+    texts = []
+    async with websockets.connect(server_url) as ws:
+        await ws.send(json.dumps({"config": {"sample_rate": SAMPLING_RATE}}))
+        speech, _ = await asyncio.to_thread(load_audio, audio_file_path, SAMPLING_RATE, 1)
+        for start in range(0, len(speech), VOSK_BLOCK_SAMPLES):
+            await ws.send(float_to_pcm16(speech[start:start + VOSK_BLOCK_SAMPLES]).tobytes())
+            # Partial results carry "partial" instead of "text"
+            result = json.loads(await ws.recv())
+            if result.get("text"):
+                texts.append(result["text"])
+        await ws.send(json.dumps({"eof": 1}))
+        texts.append(json.loads(await ws.recv()).get("text", ""))
+    return " ".join(text for text in texts if text)
+
+async def vosk_server_record(audio_file_path, server_url):
+    start_time = time.perf_counter()
+    transcript = await vosk_server_transcript(audio_file_path, server_url)
+    return manifest_record(audio_file_path, get_duration(audio_file_path), transcript, "vosk",
+                           inference_ms=elapsed_ms(start_time))
+
+async def vosk_server_records(audio_file_paths, server_url, concurrency=4):
+    """Transcribe many files on a vosk-server, keeping up to ``concurrency`` connections open.
+
+    Yields a manifest record per file as soon as it is done, so records come in
+    completion order. Files that fail are reported and skipped, which leaves
+    them out of the manifest to be retried on the next run.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def transcribe(path):
+        async with semaphore:
+            try:
+                return await vosk_server_record(path, server_url)
+            except Exception as e:
+                print(f"Failed to transcribe {path} on {server_url}: {e}")
+                return None
+
+    tasks = [asyncio.ensure_future(transcribe(path)) for path in audio_file_paths]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            record = await next_done
+            if record is not None:
+                yield record
     finally:
-        # Clean up the temporary file
-        if os.path.exists(output_txt_path):
-            os.remove(output_txt_path)
+        # The consumer may stop early; don't leave connections open
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    return transcript
+def iter_vosk_server_records(audio_file_paths, server_url, concurrency=4):
+    """vosk_server_records as a plain generator, for the synchronous directory loop."""
+    loop = asyncio.new_event_loop()
+    records = vosk_server_records(audio_file_paths, server_url, concurrency)
+    try:
+        while True:
+            try:
+                record = loop.run_until_complete(records.__anext__())
+            except StopAsyncIteration:
+                return
+            yield record
+    finally:
+        loop.run_until_complete(records.aclose())
+        loop.close()
 
 # Whisper transcription
-def whisper_transcript(audio_file_path):
-    from speechbrain.inference.ASR import WhisperASR
-
-    model = WhisperASR.from_hparams(source="speechbrain/asr-whisper-large-v2-commonvoice-fa", run_opts={"device": "cuda:0"})
+def whisper_transcript(audio_file_path, model=None):
+    if model is None:
+        model = load_whisper(MODEL_SOURCES["whisper"])
     return model.transcribe_file(audio_file_path)
 
-def transcribe_file(audio_file, model_name):
-    """Transcribe a single audio file based on the selected model."""
-    if model_name == "wav2vec_v3":
-        from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
-        processor = Wav2Vec2Processor.from_pretrained("m3hrdadfi/wav2vec2-large-xlsr-persian-v3")
-        model = Wav2Vec2ForCTC.from_pretrained("m3hrdadfi/wav2vec2-large-xlsr-persian-v3").to("cuda:0" if torch.cuda.is_available() else "cpu")
-        return wav2vec_transcript(audio_file, processor, model)
+class Backend:
+    """How to load one ASR model and transcribe a file or an in-memory array with it.
+
+    ``load(source)`` returns the model kept by the ModelRegistry, which is then
+    passed to ``transcribe_file(path, model)`` and ``transcribe_audio(speech, model)``.
+    ``family`` groups backends sharing model-specific code paths (batching,
+    long-form windows), and ``variant_of`` names the full-precision model an
+    optimized variant is compared against. ``max_audio_seconds`` is the longest
+    audio transcribe_audio handles (None for any length); transcribe_file
+    always takes whole recordings.
+    """
+
+    def __init__(self, source, load, transcribe_file, transcribe_audio, family=None, variant_of=None,
+                 max_audio_seconds=None):
+        self.source = source
+        self.load = load
+        self.transcribe_file = transcribe_file
+        self.transcribe_audio = transcribe_audio
+        self.family = family
+        self.variant_of = variant_of
+        self.max_audio_seconds = max_audio_seconds
+
+# Registered backends by model name; register_backend adds more
+BACKENDS = {}
+
+def register_backend(name, source, load, transcribe_file, transcribe_audio, family=None, variant_of=None,
+                     max_audio_seconds=None):
+    BACKENDS[name] = Backend(source, load, transcribe_file, transcribe_audio, family, variant_of,
+                             max_audio_seconds)
+
+def get_backend(model_name):
+    if model_name not in BACKENDS:
+        raise ValueError(f"Unknown model: {model_name}")
+    return BACKENDS[model_name]
+
+def is_wav2vec(model_name):
+    return model_name in BACKENDS and BACKENDS[model_name].family == "wav2vec"
+
+for _name in ("wav2vec_v3", "wav2vec_fa"):
+    # name-int8 and name-onnx are CPU-optimized variants of the same checkpoint
+    for _optimize in (None, "int8", "onnx"):
+        register_backend(
+            f"{_name}-{_optimize}" if _optimize else _name, MODEL_SOURCES[_name],
+            lambda source, optimize=_optimize: load_wav2vec(source, optimize),
+            lambda path, model: wav2vec_transcript(path, *model),
+            lambda speech, model: wav2vec_transcribe_array(speech, *model),
+            family="wav2vec", variant_of=_name if _optimize else None
+        )
+# Whisper models see at most 30 s of audio per call
+register_backend("hezar", MODEL_SOURCES["hezar"], load_hezar, hezar_transcript, hezar_transcribe_array,
+                 max_audio_seconds=30.0)
+register_backend(
+    "vosk", MODEL_SOURCES["vosk"], load_vosk, vosk_transcript,
+    lambda speech, model: vosk_transcribe_blocks([speech], model)
+)
+register_backend(
+    "whisper", MODEL_SOURCES["whisper"], load_whisper, whisper_transcript,
+    lambda speech, model: whisper_batch_transcripts([speech], model)[0],
+    max_audio_seconds=30.0
+)
+
+def transcribe_file(audio_file, model_name, registry=None):
+    """Transcribe a single audio file based on the selected model.
+
+    Models are taken from ``registry`` (the module-level default if omitted), so
+    repeated calls reuse the already loaded weights.
+    """
+    registry = registry or default_registry
+    return get_backend(model_name).transcribe_file(audio_file, registry.get(model_name))
+
+def transcribe_audio(speech, model_name, registry=None):
+    """Transcribe a 16 kHz mono float32 array that is already in memory.
 
-    elif model_name == "wav2vec_fa":
-        from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
-        processor = Wav2Vec2Processor.from_pretrained("masoudmzb/wav2vec2-xlsr-multilingual-53-fa")
-        model = Wav2Vec2ForCTC.from_pretrained("masoudmzb/wav2vec2-xlsr-multilingual-53-fa").to("cuda:0" if torch.cuda.is_available() else "cpu")
-        return wav2vec_transcript(audio_file, processor, model)
+    Used when audio comes from another stage (VAD segments, an ensemble decode)
+    rather than from a file, so it is not decoded again.
+    """
+    registry = registry or default_registry
+    return get_backend(model_name).transcribe_audio(speech, registry.get(model_name))
 
-    elif model_name == "hezar":
-        return hezar_transcript(audio_file)
+def whisper_batch_transcripts(speeches, model):
+    """Transcribe a list of 16 kHz mono arrays with one SpeechBrain Whisper batch."""
+    import torch
 
-    elif model_name == "vosk":
-        return vosk_transcript(audio_file)
+    lengths = [len(speech) for speech in speeches]
+    wavs = torch.zeros(len(speeches), max(lengths))
+    for row, speech in enumerate(speeches):
+        wavs[row, :lengths[row]] = torch.as_tensor(np.asarray(speech, dtype=np.float32))
+    words, _ = model.transcribe_batch(wavs, torch.tensor(lengths, dtype=torch.float32) / max(lengths))
+    return [" ".join(text) if isinstance(text, list) else text for text in words]
 
+# Long-form transcription: recordings of any length, cut into model-sized pieces
+def iter_strided_windows(blocks, window_samples, stride_samples):
+    """Cut a stream of mono blocks into overlapping windows.
+
+    Yields ``(start, samples, drop_left, drop_right)``: consecutive windows
+    overlap by ``2 * stride_samples``, and only the middle of each window,
+    without ``drop_left``/``drop_right`` samples of context, should be kept.
+    Kept regions tile the input exactly. Only about one window of audio is
+    buffered at a time.
+    """
+    step = window_samples - 2 * stride_samples
+    if step <= 0:
+        raise ValueError("The window must be longer than twice the stride")
+    buffer = np.zeros(0, dtype=np.float32)
+    start = 0
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        # A window is only final if nothing follows it, so wait for more audio than one window
+        while len(buffer) > window_samples:
+            yield start, buffer[:window_samples], stride_samples if start else 0, stride_samples
+            buffer = buffer[step:]
+            start += step
+    if len(buffer):
+        yield start, buffer, stride_samples if start else 0, 0
+
+def speech_pieces(timestamps, max_samples):
+    """Merge neighbouring VAD segments into pieces of at most max_samples.
+
+    Segments longer than that are split into equal parts. Returns
+    ``(start, end)`` sample pairs in order.
+    """
+    pieces = []
+    for ts in timestamps:
+        if pieces and ts['end'] - pieces[-1][0] <= max_samples:
+            pieces[-1] = (pieces[-1][0], ts['end'])
+            continue
+        num_parts = -(-(ts['end'] - ts['start']) // max_samples)
+        bounds = np.linspace(ts['start'], ts['end'], num_parts + 1).astype(int)
+        pieces.extend(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    return pieces
+
+def group_words(words, max_gap_seconds=0.5, max_segment_seconds=LONG_FORM_WINDOW_SECONDS):
+    """Join timed words into segments, breaking at pauses longer than max_gap_seconds."""
+    segments = []
+    for word in words:
+        if (segments and word["start"] - segments[-1]["end"] <= max_gap_seconds
+                and word["end"] - segments[-1]["start"] <= max_segment_seconds):
+            segments[-1]["end"] = word["end"]
+            segments[-1]["text"] += " " + word["text"]
+        else:
+            segments.append(dict(word))
+    return segments
+
+def wav2vec_long_transcribe(audio_file_path, processor, model, window_seconds=LONG_FORM_WINDOW_SECONDS,
+                            stride_seconds=LONG_FORM_STRIDE_SECONDS, batch_size=4):
+    """Transcribe a recording of any length with strided wav2vec2 windows.
+
+    The audio is streamed from ffmpeg and run through the model in batches of
+    overlapping windows. The CTC frames belonging to each window's context
+    are dropped, and the kept frames of all windows are decoded together, so
+    words cut by a window edge are recognised from the neighbouring window.
+    """
+    import torch
+
+    sampling_rate = processor.feature_extractor.sampling_rate
+    # Input samples per CTC frame (320 for wav2vec2)
+    ratio = model.config.inputs_to_logits_ratio
+    windows = iter_strided_windows(
+        (block[0] for block in iter_audio_blocks(audio_file_path, 10 * sampling_rate, sampling_rate)),
+        int(window_seconds * sampling_rate), int(stride_seconds * sampling_rate)
+    )
+
+    pred_ids = []
+    for batch in list_batches(windows, batch_size):
+        logits = wav2vec_batch_logits([samples for _, samples, _, _ in batch], processor, model)
+        for row, (start, samples, drop_left, drop_right) in enumerate(batch):
+            # Bounds come from absolute sample positions, so the kept frames of
+            # consecutive windows meet exactly; the model emits one frame fewer
+            # than len/ratio, so counting from the end would lose a frame
+            offset = int(round(start / ratio))
+            first = int(round((start + drop_left) / ratio)) - offset
+            if drop_right:
+                last = int(round((start + len(samples) - drop_right) / ratio)) - offset
+            else:
+                # Only the final window runs to its end (its own end, as batches are padded)
+                last = int(round(len(samples) / ratio))
+            pred_ids.append(torch.argmax(logits[row, first:min(last, logits.shape[1])], dim=-1))
+
+    if not pred_ids:
+        return "", []
+    output = processor.tokenizer.decode(torch.cat(pred_ids).tolist(), output_word_offsets=True)
+    seconds_per_frame = ratio / sampling_rate
+    words = [
+        {"start": round(word["start_offset"] * seconds_per_frame, 2),
+         "end": round(word["end_offset"] * seconds_per_frame, 2),
+         "text": word["word"]}
+        for word in output.word_offsets
+    ]
+    return output.text, group_words(words)
+
+def whisper_long_transcribe(audio_file_path, model, window_seconds=LONG_FORM_WINDOW_SECONDS, batch_size=4):
+    """Transcribe a recording of any length with Whisper in consecutive windows.
+
+    Whisper produces text rather than frame-aligned output, so its windows do
+    not overlap; use VAD mode to avoid cutting through words.
+    """
+    window_samples = int(window_seconds * SAMPLING_RATE)
+    blocks = (block[0] for block in iter_audio_blocks(audio_file_path, window_samples, SAMPLING_RATE))
+    segments = []
+    start = 0
+    for batch in list_batches(blocks, batch_size):
+        for samples, text in zip(batch, whisper_batch_transcripts(batch, model)):
+            end = start + len(samples)
+            segments.append({"start": round(start / SAMPLING_RATE, 2), "end": round(end / SAMPLING_RATE, 2), "text": text})
+            start = end
+    return " ".join(segment["text"] for segment in segments if segment["text"]), segments
+
+def list_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def vad_long_transcribe(audio_file_path, model_name, registry, vad, window_seconds=LONG_FORM_WINDOW_SECONDS,
+                        max_batch_seconds=120.0, cache_dir=None):
+    """Transcribe the speech of a recording of any length, cut at VAD segments.
+
+    Neighbouring speech segments are merged into pieces of up to
+    window_seconds and transcribed in length-bucketed batches. With a
+    cache_dir the decoded audio is memory-mapped rather than held in memory.
+    """
+    import torch
+
+    speech = vad.read_audio(audio_file_path, cache_dir)
+    pieces = speech_pieces(vad.get_speech_timestamps(speech), int(window_seconds * SAMPLING_RATE))
+    durations = [(end - start) / SAMPLING_RATE for start, end in pieces]
+
+    texts = [""] * len(pieces)
+    for batch in make_duration_batches(durations, max_batch_seconds):
+        speeches = [np.asarray(speech[pieces[idx][0]:pieces[idx][1]], dtype=np.float32) for idx in batch]
+        if is_wav2vec(model_name):
+            processor, model = registry.get(model_name)
+            pred_ids = torch.argmax(wav2vec_batch_logits(speeches, processor, model), dim=-1)
+            batch_texts = processor.batch_decode(pred_ids)
+        elif model_name == "whisper":
+            batch_texts = whisper_batch_transcripts(speeches, registry.get(model_name))
+        else:
+            batch_texts = [transcribe_audio(piece, model_name, registry) for piece in speeches]
+        for idx, text in zip(batch, batch_texts):
+            texts[idx] = text.strip()
+
+    segments = [
+        {"start": round(start / SAMPLING_RATE, 2), "end": round(end / SAMPLING_RATE, 2), "text": text}
+        for (start, end), text in zip(pieces, texts)
+    ]
+    return " ".join(text for text in texts if text), segments
+
+def long_form_transcribe(audio_file_path, model_name, registry=None, mode="vad", vad=None,
+                         window_seconds=LONG_FORM_WINDOW_SECONDS, stride_seconds=LONG_FORM_STRIDE_SECONDS,
+                         max_batch_seconds=120.0, cache_dir=None):
+    """Transcribe a recording of any length, returning ``(text, segments)``.
+
+    ``segments`` are ``{"start", "end", "text"}`` dicts with times in seconds.
+    ``mode="vad"`` transcribes VAD speech segments with any backend;
+    ``mode="strided"`` runs overlapping windows over all the audio, for
+    wav2vec2 and Whisper. Batches hold at most max_batch_seconds of audio.
+    Strided mode streams the audio; VAD mode decodes the whole recording,
+    into memory or, with a cache_dir, into a memory-mapped cache file.
+    """
+    registry = registry or default_registry
+
+    if mode == "vad":
+        return vad_long_transcribe(audio_file_path, model_name, registry, vad or VAD(),
+                                   window_seconds, max_batch_seconds, cache_dir)
+
+    batch_size = max(1, int(max_batch_seconds // window_seconds))
+    if is_wav2vec(model_name):
+        processor, model = registry.get(model_name)
+        return wav2vec_long_transcribe(audio_file_path, processor, model, window_seconds, stride_seconds, batch_size)
     elif model_name == "whisper":
-        return whisper_transcript(audio_file)
+        return whisper_long_transcribe(audio_file_path, registry.get(model_name), window_seconds, batch_size)
+    raise ValueError(f"Strided long-form transcription is not supported for {model_name}")
+
+def print_segments(segments):
+    for segment in segments:
+        print(f"[{segment['start']:.2f} - {segment['end']:.2f}] {segment['text']}")
+
+# Manifest output: one NeMo-style JSON line per transcribed file
+def elapsed_ms(start_time):
+    return (time.perf_counter() - start_time) * 1000
 
-def transcribe_directory(directory, model_name):
-    """Transcribe all WAV files in the directory and its subdirectories."""
+def manifest_record(audio_filepath, duration, pred_text, model_name, model_load_ms=0.0, decode_ms=None,
+                    inference_ms=None, **extra):
+    """Manifest line for one file; rtf is processing time over audio duration."""
+    processing_ms = (decode_ms or 0.0) + (inference_ms or 0.0)
+    record = {
+        "audio_filepath": audio_filepath,
+        "duration": round(duration, 3),
+        "pred_text": pred_text,
+        "model_name": model_name,
+        "model_load_ms": round(model_load_ms, 1),
+        "decode_ms": None if decode_ms is None else round(decode_ms, 1),
+        "inference_ms": None if inference_ms is None else round(inference_ms, 1),
+        "rtf": round(processing_ms / 1000 / duration, 4) if duration else None
+    }
+    record.update(extra)
+    return record
+
+def timed_transcribe_file(audio_file, model_name, registry=None):
+    """Transcribe a file with transcribe_file, returning a manifest record with its timings.
+
+    Backends read the file themselves, so decoding counts as inference time.
+    """
+    registry = registry or default_registry
+    start_time = time.perf_counter()
+    registry.get(model_name)
+    model_load_ms = elapsed_ms(start_time)
+
+    start_time = time.perf_counter()
+    transcript = transcribe_file(audio_file, model_name, registry)
+    return manifest_record(audio_file, get_duration(audio_file), transcript, model_name,
+                           model_load_ms, inference_ms=elapsed_ms(start_time))
+
+def timed_long_form_transcribe(audio_file, model_name, registry=None, **kwargs):
+    """long_form_transcribe as a manifest record, with the timed segments under "segments".
+
+    Long-form modes decode while transcribing, so both count as inference time.
+    """
+    registry = registry or default_registry
+    start_time = time.perf_counter()
+    registry.get(model_name)
+    model_load_ms = elapsed_ms(start_time)
+
+    start_time = time.perf_counter()
+    transcript, segments = long_form_transcribe(audio_file, model_name, registry, **kwargs)
+    return manifest_record(audio_file, get_duration(audio_file), transcript, model_name, model_load_ms,
+                           inference_ms=elapsed_ms(start_time), segments=segments)
+
+def read_manifest(manifest_path):
+    """Load a manifest as {audio_filepath: record}; a torn last line is ignored."""
+    return {record["audio_filepath"]: record for record in iter_jsonl(manifest_path)}
+
+class ManifestWriter:
+    """Appends manifest records as JSON lines, flushing each one.
+
+    An interrupted run keeps every finished file, and reopening the manifest
+    resumes it: ``audio_filepath in writer`` tells which files are done.
+    Safe to share between threads.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.ids = set(read_manifest(manifest_path))
+        self._file = open_jsonl_for_append(manifest_path)
+        self._lock = threading.Lock()
+
+    def __contains__(self, audio_filepath):
+        return audio_filepath in self.ids
+
+    def write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.ids.add(record["audio_filepath"])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Ensemble transcription: one decode, several resident models
+def normalize_words(text):
+    """Split a transcript into words; zero-width non-joiners count as word breaks."""
+    return text.replace("\u200c", " ").split()
+
+def edit_distance(ref, hyp):
+    """Levenshtein distance between two sequences, using one row of memory."""
+    row = list(range(len(hyp) + 1))
+    for i, ref_item in enumerate(ref, 1):
+        diagonal, row[0] = row[0], i
+        for j, hyp_item in enumerate(hyp, 1):
+            diagonal, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, diagonal + (ref_item != hyp_item))
+    return row[-1]
+
+def word_error_rate(ref, hyp):
+    ref_words = normalize_words(ref)
+    return edit_distance(ref_words, normalize_words(hyp)) / max(len(ref_words), 1)
+
+def char_error_rate(ref, hyp):
+    ref_chars = " ".join(normalize_words(ref))
+    return edit_distance(ref_chars, " ".join(normalize_words(hyp))) / max(len(ref_chars), 1)
+
+def pick_best_hypothesis(hypotheses):
+    """Choose the hypothesis closest to all others.
+
+    Returns ``(best_model, pairwise)`` where pairwise maps ``"a|b"`` to the
+    WER and CER of b against a. The best model has the lowest mean WER
+    against the rest, ties broken by CER, so an outlier never wins. This needs
+    at least three models: with two, both are equally far from each other and
+    the first one listed is always picked.
+    """
+    models = list(hypotheses)
+    pairwise = {}
+    mean_wer = {model: 0.0 for model in models}
+    mean_cer = {model: 0.0 for model in models}
+    for i, ref_model in enumerate(models):
+        for hyp_model in models[i + 1:]:
+            wer = word_error_rate(hypotheses[ref_model], hypotheses[hyp_model])
+            cer = char_error_rate(hypotheses[ref_model], hypotheses[hyp_model])
+            pairwise[f"{ref_model}|{hyp_model}"] = {"wer": round(wer, 4), "cer": round(cer, 4)}
+            for model in (ref_model, hyp_model):
+                mean_wer[model] += wer
+                mean_cer[model] += cer
+    best_model = min(models, key=lambda model: (mean_wer[model], mean_cer[model]))
+    return best_model, pairwise
+
+def timed_ensemble_transcribe_file(audio_file, model_names, registry=None):
+    """Decode a file once, transcribe it with every model and record the best hypothesis.
+
+    The record's pred_text is the best hypothesis; every model's text and
+    inference time and the pairwise WER/CER are kept alongside it. Models
+    whose transcribe_audio is limited to shorter audio than the file read it
+    from the file instead.
+    """
+    registry = registry or default_registry
+    start_time = time.perf_counter()
+    for model_name in model_names:
+        registry.get(model_name)
+    model_load_ms = elapsed_ms(start_time)
+
+    start_time = time.perf_counter()
+    speech, _ = load_audio(audio_file, SAMPLING_RATE, channels=1)
+    decode_ms = elapsed_ms(start_time)
+
+    hypotheses, model_inference_ms = {}, {}
+    for model_name in model_names:
+        start_time = time.perf_counter()
+        max_seconds = get_backend(model_name).max_audio_seconds
+        if max_seconds is not None and len(speech) > max_seconds * SAMPLING_RATE:
+            hypotheses[model_name] = transcribe_file(audio_file, model_name, registry)
+        else:
+            hypotheses[model_name] = transcribe_audio(speech, model_name, registry)
+        model_inference_ms[model_name] = round(elapsed_ms(start_time), 1)
+
+    best_model, pairwise = pick_best_hypothesis(hypotheses)
+    return manifest_record(
+        audio_file, len(speech) / SAMPLING_RATE, hypotheses[best_model], "ensemble", model_load_ms, decode_ms,
+        sum(model_inference_ms.values()), best_model=best_model, hypotheses=hypotheses,
+        model_inference_ms=model_inference_ms, pairwise=pairwise
+    )
+
+# Accuracy check of CPU-optimized variants against their full-precision model
+def read_references(manifest_path):
+    """(audio_filepath, text) pairs from a manifest whose lines carry a reference "text"."""
+    references = []
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                references.append((record["audio_filepath"], record["text"]))
+    return references
+
+def accuracy_check(manifest_path, model_name, registry=None):
+    """Corpus WER and real-time factor of a variant and its full-precision model on reference transcripts."""
+    registry = registry or default_registry
+    baseline_name = get_backend(model_name).variant_of
+    if baseline_name is None:
+        raise ValueError(f"{model_name} is not an optimized variant of another model")
+    references = read_references(manifest_path)
+
+    results = {}
+    for name in (baseline_name, model_name):
+        errors = words = 0
+        audio_seconds = processing_ms = 0.0
+        for audio_path, text in references:
+            record = timed_transcribe_file(audio_path, name, registry)
+            ref_words = normalize_words(text)
+            errors += edit_distance(ref_words, normalize_words(record["pred_text"]))
+            words += len(ref_words)
+            audio_seconds += record["duration"]
+            processing_ms += (record["decode_ms"] or 0.0) + record["inference_ms"]
+        results[name] = {
+            "wer": errors / max(words, 1),
+            "rtf": processing_ms / 1000 / audio_seconds if audio_seconds else None
+        }
+
+    baseline, variant = results[baseline_name], results[model_name]
+    return {
+        "files": len(references),
+        "results": results,
+        "wer_delta": variant["wer"] - baseline["wer"],
+        "speedup": baseline["rtf"] / variant["rtf"] if baseline["rtf"] and variant["rtf"] else None
+    }
+
+def find_wav_files(directory):
+    """List all WAV files in the directory and its subdirectories."""
+    wav_files = []
     for subdir, _, files in os.walk(directory):
         for file in files:
             if file.endswith(".wav"):
-                audio_path = os.path.join(subdir, file)
-                print(f"Transcribing: {audio_path}")
-                transcript = transcribe_file(audio_path, model_name)
-                print(f"Transcript:\n{transcript}\n")
+                wav_files.append(os.path.join(subdir, file))
+    return wav_files
+
+def transcribe_directory(directory, model_name, registry=None, batch_seconds=None, workers=1, vosk_server=None,
+                         long_form=None, window_seconds=LONG_FORM_WINDOW_SECONDS,
+                         stride_seconds=LONG_FORM_STRIDE_SECONDS, manifest_path=None, ensemble=None,
+                         source_cache_dir=None):
+    """Transcribe all WAV files in the directory and its subdirectories.
+
+    With ``batch_seconds`` set, wav2vec models run length-bucketed batches of
+    at most that much padded audio instead of one file per forward pass.
+    Otherwise up to ``workers`` files are transcribed concurrently, sharing the
+    registry's models. With ``vosk_server`` set, Vosk requests go to that
+    server instead of an in-process model. With ``long_form`` set, each file
+    is transcribed in pieces (see long_form_transcribe). With a
+    ``manifest_path``, a record per file is appended to that manifest and
+    files already in it are skipped. With ``ensemble``, a list of model names,
+    every file is decoded once and transcribed by all of them (model_name is
+    ignored). With ``source_cache_dir``, VAD long-form mode memory-maps each
+    decoded recording from that directory instead of holding it in memory.
+    """
+    registry = registry or default_registry
+    wav_files = find_wav_files(directory)
+    manifest = ManifestWriter(manifest_path) if manifest_path else None
+    if manifest is not None:
+        pending = [path for path in wav_files if path not in manifest]
+        print(f"Skipping {len(wav_files) - len(pending)} files already in {manifest_path}")
+        wav_files = pending
+
+    try:
+        if ensemble:
+            records = iter_ensemble_records(wav_files, ensemble, registry, workers)
+        else:
+            records = iter_directory_records(wav_files, model_name, registry, batch_seconds, workers, vosk_server,
+                                             long_form, window_seconds, stride_seconds, source_cache_dir)
+        for record in records:
+            if "hypotheses" in record:
+                print(f"Transcript for {record['audio_filepath']} (best: {record['best_model']}):\n{record['pred_text']}\n")
+            elif "segments" in record:
+                print(f"Transcript for {record['audio_filepath']}:")
+                print_segments(record["segments"])
+                print()
+            else:
+                print(f"Transcript for {record['audio_filepath']}:\n{record['pred_text']}\n")
+            if manifest is not None:
+                manifest.write(record)
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+def iter_ensemble_records(wav_files, model_names, registry, workers=1):
+    """Ensemble-transcribe wav_files, yielding a manifest record per file."""
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(lambda path: timed_ensemble_transcribe_file(path, model_names, registry), wav_files)
+        return
+
+    for audio_path in wav_files:
+        print(f"Transcribing: {audio_path}")
+        yield timed_ensemble_transcribe_file(audio_path, model_names, registry)
+
+def iter_directory_records(wav_files, model_name, registry, batch_seconds, workers, vosk_server,
+                           long_form, window_seconds, stride_seconds, source_cache_dir=None):
+    """Transcribe wav_files with the chosen strategy, yielding a manifest record per file."""
+    if long_form:
+        vad = VAD() if long_form == "vad" else None
+        for audio_path in wav_files:
+            yield timed_long_form_transcribe(audio_path, model_name, registry, mode=long_form, vad=vad,
+                                             window_seconds=window_seconds, stride_seconds=stride_seconds,
+                                             max_batch_seconds=batch_seconds or 120.0, cache_dir=source_cache_dir)
+        return
+
+    if model_name == "vosk" and vosk_server:
+        print(f"Transcribing {len(wav_files)} files on {vosk_server}")
+        yield from iter_vosk_server_records(wav_files, vosk_server, workers)
+        return
+
+    if batch_seconds and is_wav2vec(model_name):
+        start_time = time.perf_counter()
+        processor, model = registry.get(model_name)
+        model_load_ms = elapsed_ms(start_time)
+        print(f"Transcribing {len(wav_files)} files in batches of up to {batch_seconds}s of audio")
+        for audio_path, transcript, timings in wav2vec_batch_transcripts(
+                wav_files, processor, model, batch_seconds, with_timings=True):
+            yield manifest_record(audio_path, timings["duration"], transcript, model_name, model_load_ms,
+                                  timings["decode_ms"], timings["inference_ms"])
+            model_load_ms = 0.0
+        return
+
+    if workers > 1:
+        # The registry lock makes the first workers wait for a single model load
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(lambda path: timed_transcribe_file(path, model_name, registry), wav_files)
+        return
+
+    for audio_path in wav_files:
+        print(f"Transcribing: {audio_path}")
+        yield timed_transcribe_file(audio_path, model_name, registry)
 
 
 def main():
     args = parse_args()
     input_path = args.input_path
+    if args.threads:
+        import torch
+
+        torch.set_num_threads(args.threads)
+    # Ensemble models must all stay resident, or each file would reload them
+    max_models = max(args.max_loaded_models, len(args.ensemble or []))
+    if args.ensemble and len(set(args.ensemble)) < 3:
+        warnings.warn(
+            "--ensemble needs at least three models to pick a best hypothesis; "
+            f"with fewer, {args.ensemble[0]} is always chosen."
+        )
+    registry = ModelRegistry(max_models, args.max_model_memory_gb)
+
+    if args.accuracy_check:
+        report = accuracy_check(input_path, args.model, registry)
+        print(f"Accuracy check on {report['files']} files:")
+        for name, result in report["results"].items():
+            rtf = "n/a" if result["rtf"] is None else f"{result['rtf']:.4f}"
+            print(f"- {name}: WER {result['wer']:.4f}, RTF {rtf}")
+        speedup = "n/a" if report["speedup"] is None else f"{report['speedup']:.2f}x"
+        print(f"WER delta: {report['wer_delta']:+.4f}, speedup: {speedup}")
+        if args.max_wer_delta is not None and report["wer_delta"] > args.max_wer_delta:
+            print(f"WER delta exceeds {args.max_wer_delta}")
+            sys.exit(1)
+        return
 
     if os.path.isfile(input_path) and input_path.endswith(".wav"):
         print(f"Transcribing file: {input_path}")
-        transcript = transcribe_file(input_path, args.model)
-        print(f"Transcript:\n{transcript}")
+        if args.ensemble:
+            record = timed_ensemble_transcribe_file(input_path, args.ensemble, registry)
+            print(f"Transcript (best: {record['best_model']}):\n{record['pred_text']}")
+            for pair, rates in record["pairwise"].items():
+                print(f"{pair}: WER {rates['wer']:.3f}, CER {rates['cer']:.3f}")
+        elif args.long_form:
+            record = timed_long_form_transcribe(
+                input_path, args.model, registry, mode=args.long_form, window_seconds=args.window_seconds,
+                stride_seconds=args.stride_seconds, max_batch_seconds=args.batch_seconds or 120.0,
+                cache_dir=args.source_cache_dir
+            )
+            print_segments(record["segments"])
+        elif args.model == "vosk" and args.vosk_server:
+            record = asyncio.run(vosk_server_record(input_path, args.vosk_server))
+            print(f"Transcript:\n{record['pred_text']}")
+        else:
+            record = timed_transcribe_file(input_path, args.model, registry)
+            print(f"Transcript:\n{record['pred_text']}")
+        if args.manifest:
+            with ManifestWriter(args.manifest) as manifest:
+                manifest.write(record)
 
     elif os.path.isdir(input_path):
         print(f"Transcribing all WAV files in directory: {input_path}")
-        transcribe_directory(input_path, args.model)
+        transcribe_directory(input_path, args.model, registry, args.batch_seconds, args.workers, args.vosk_server,
+                             args.long_form, args.window_seconds, args.stride_seconds, args.manifest, args.ensemble,
+                             args.source_cache_dir)
 
     else:
         print(f"Invalid input: {input_path}. Please provide a valid WAV file or directory.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
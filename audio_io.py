@@ -0,0 +1,260 @@
+import os
+import hashlib
+import subprocess
+import tempfile
+import threading
+import wave
+from collections import deque
+import numpy as np
+
+# Lines of ffmpeg's stderr kept for error messages
+STDERR_TAIL_LINES = 50
+
+def ffmpeg_decode_command(path, sample_rate, channels=1, resampler=None):
+    """ffmpeg command that decodes, downmixes and resamples path to raw float32 on stdout.
+
+    resampler='soxr' selects the SoX resampler (needs an ffmpeg built with libsoxr);
+    by default ffmpeg's own swr resampler is used.
+    """
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-i', str(path)]
+    if resampler:
+        cmd += ['-af', f'aresample=resampler={resampler}']
+    return cmd + [
+        '-f', 'f32le', '-acodec', 'pcm_f32le',
+        '-ac', str(channels), '-ar', str(sample_rate), '-'
+    ]
+
+def load_audio(path, sample_rate, channels=1, resampler=None):
+    """Decode any ffmpeg-readable file to float32 in a single ffmpeg pass.
+
+    Returns ``(samples, sample_rate)`` where samples is ``(samples,)`` for mono
+    and ``(channels, samples)`` otherwise. Multi-channel input is downmixed
+    and resampled by ffmpeg while decoding, so nothing is resampled in Python.
+    """
+    process = subprocess.Popen(
+        ffmpeg_decode_command(path, sample_rate, channels, resampler),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    # communicate reads both pipes at once, so a chatty stderr can't stall the decode
+    data, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr.decode(errors='replace').strip()}")
+
+    num_frames = len(data) // (4 * channels)
+    samples = np.frombuffer(data, dtype='<f4', count=num_frames * channels)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).T
+    return samples, sample_rate
+
+def convert_audio_file(input_path, output_path, sample_rate, channels=1, resampler=None):
+    """Decode, downmix and resample input_path into a 16-bit PCM WAV with one ffmpeg call.
+
+    The WAV is written under a temporary name and renamed when complete.
+    """
+    partial_path = f'{output_path}.partial'
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', str(input_path)]
+    if resampler:
+        cmd += ['-af', f'aresample=resampler={resampler}']
+    cmd += ['-ac', str(channels), '-ar', str(sample_rate), '-c:a', 'pcm_s16le', '-f', 'wav', partial_path]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise RuntimeError(f"ffmpeg failed to convert {input_path}: {result.stderr.decode(errors='replace').strip()}")
+    os.replace(partial_path, output_path)
+    return str(output_path)
+
+def get_duration(path):
+    """Duration in seconds, read from the header for WAV files and via ffprobe otherwise."""
+    if str(path).lower().endswith('.wav'):
+        try:
+            with wave.open(str(path), 'rb') as wav:
+                return wav.getnframes() / wav.getframerate()
+        except (wave.Error, EOFError):
+            pass  # e.g. float WAVs, which the wave module can't parse
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', str(path)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+    return float(result.stdout.decode().strip())
+
+
+def float_to_pcm16(samples):
+    """Convert float samples in [-1, 1] to little-endian 16-bit PCM."""
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+
+class WavWriter:
+    """Incrementally writes float32 samples to a 16-bit PCM WAV file.
+
+    ``write`` takes mono ``(samples,)`` or ``(channels, samples)`` arrays, so
+    processed chunks can be appended as they arrive without concatenating them.
+    """
+
+    def __init__(self, path, sample_rate, channels=1):
+        self.path = str(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.num_frames = 0
+        self._wav = wave.open(self.path, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(sample_rate)
+
+    def write(self, samples):
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[None, :]
+        if samples.shape[0] != self.channels:
+            raise ValueError(f"Expected {self.channels} channels, got {samples.shape[0]}")
+        # WAV frames are interleaved, i.e. (samples, channels)
+        self._wav.writeframes(float_to_pcm16(samples.T).tobytes())
+        self.num_frames += samples.shape[1]
+
+    def close(self):
+        self._wav.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def write_wav(path, samples, sample_rate):
+    """Write a mono or (channels, samples) float array to a 16-bit WAV file in one go."""
+    samples = np.atleast_2d(samples)
+    with WavWriter(path, sample_rate, samples.shape[0]) as writer:
+        writer.write(samples)
+    return str(path)
+
+def drain_stderr(process):
+    """Read a process's stderr on a thread, keeping the last lines for error messages.
+
+    Without this, a process writing more than a pipe buffer of stderr blocks
+    while we are still reading its stdout.
+    """
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+
+    def drain():
+        with process.stderr:
+            for line in process.stderr:
+                tail.append(line.decode(errors='replace').rstrip())
+
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    return thread, tail
+
+def iter_audio_blocks(path, block_samples, sample_rate, channels=1, resampler=None):
+    """Decode any ffmpeg-readable file and yield float32 (channels, samples) blocks.
+
+    ffmpeg resamples to sample_rate and mixes to channels while decoding, and only
+    one block of at most block_samples frames is in memory at a time.
+    """
+    process = subprocess.Popen(
+        ffmpeg_decode_command(path, sample_rate, channels, resampler),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stderr_thread, stderr_tail = drain_stderr(process)
+    frame_bytes = 4 * channels
+    finished = False
+    try:
+        while True:
+            data = process.stdout.read(block_samples * frame_bytes)
+            if not data:
+                break
+            data = data[:len(data) - len(data) % frame_bytes]
+            yield np.frombuffer(data, dtype='<f4').reshape(-1, channels).T
+        finished = True
+    finally:
+        # The consumer may stop early, in which case ffmpeg is still running
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        return_code = process.wait()
+        stderr_thread.join()
+    if return_code != 0:
+        stderr = '\n'.join(stderr_tail)
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr.strip()}")
+
+class AudioSource:
+    """A recording decoded once into a cached raw float32 file and read through numpy.memmap.
+
+    The cache file is named after the source path, size, mtime, sample rate and
+    channel count, so every tool and worker process asking for the same decode
+    reuses one file and shares its pages. ``samples`` is ``(samples,)`` for mono
+    and ``(channels, samples)`` otherwise, and slicing it never copies. Pickling
+    only carries the paths, so handing a source to a worker process is cheap.
+    """
+
+    def __init__(self, path, sample_rate, channels=1, cache_dir=None, resampler=None):
+        self.path = str(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.resampler = resampler
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'audio_source_cache')
+        self.cache_path = os.path.join(self.cache_dir, f'{self._cache_key()}.f32')
+        if not os.path.exists(self.cache_path):
+            self._decode()
+        self._open()
+
+    def _cache_key(self):
+        stat = os.stat(self.path)
+        key = f'{os.path.abspath(self.path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.sample_rate}|{self.channels}|{self.resampler}'
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _decode(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Decode under a per-process name so concurrent decodes of one file don't clash
+        partial_path = f'{self.cache_path}.{os.getpid()}.partial'
+        with open(partial_path, 'wb') as f:
+            result = subprocess.run(
+                ffmpeg_decode_command(self.path, self.sample_rate, self.channels, self.resampler),
+                stdout=f, stderr=subprocess.PIPE
+            )
+        if result.returncode != 0:
+            os.remove(partial_path)
+            raise RuntimeError(f"ffmpeg failed to decode {self.path}: {result.stderr.decode(errors='replace').strip()}")
+        os.replace(partial_path, self.cache_path)
+
+    def _open(self):
+        num_frames = os.path.getsize(self.cache_path) // (4 * self.channels)
+        if num_frames == 0:
+            # numpy can't map an empty file
+            raw = np.zeros(0, dtype='<f4')
+        else:
+            raw = np.memmap(self.cache_path, dtype='<f4', mode='r', shape=(num_frames * self.channels,))
+        self.samples = raw if self.channels == 1 else raw.reshape(-1, self.channels).T
+
+    def __len__(self):
+        return self.samples.shape[-1]
+
+    @property
+    def duration(self):
+        return len(self) / self.sample_rate
+
+    def slice(self, start, end):
+        """Zero-copy view of samples [start, end)."""
+        return self.samples[..., start:end]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['samples']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+class AudioSlice:
+    """Picklable reference to samples [start, end) of an AudioSource.
+
+    Worker processes receive the reference instead of the samples and read them
+    from the shared memory-mapped cache file.
+    """
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def load(self):
+        return self.source.slice(self.start, self.end)
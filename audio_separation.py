@@ -1,14 +1,39 @@
 import os
+import re
 import sys
+import json
+import glob
 import shutil
+import threading
 import argparse
 import subprocess
+import multiprocessing
 import logging
 import time
+import hashlib
+import uuid
+import importlib.util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Literal, Optional
+from typing import Iterable, Iterator, List, Literal, Optional
 from dataclasses import dataclass
-from pydub import AudioSegment
+import numpy as np
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from audio_io import AudioSlice, AudioSource, WavWriter, iter_audio_blocks, load_audio, write_wav
+from shards import ShardWriter
+
+# Both Spleeter and the htdemucs models work on 44.1 kHz audio
+SEPARATION_SAMPLE_RATE = 44100
+
+# tqdm progress bars ("  42%|████▏     | 12.3/29.1 [...]"), printed but not logged
+PROGRESS_LINE = re.compile(r'\d+%\|')
+
+# Output lines kept from a failed separation command for its error message
+ERROR_TAIL_LINES = 20
 
 @dataclass
 class ProcessingConfig:
@@ -16,14 +41,354 @@ class ProcessingConfig:
     output_bitrate: str = "128k"
     log_level: str = "INFO"
     log_file: Optional[str] = "audio_processing.log"
+    num_workers: int = 1
+    separation_backend: Literal['inprocess', 'subprocess'] = 'inprocess'
+    demucs_model: str = 'htdemucs_ft'
+    device: Optional[str] = None
+    streaming: bool = False
+    overlap_seconds: float = 0.0
+    cache_dir: Optional[str] = None
+    cache_max_gb: float = 20.0
+    shard_dir: Optional[str] = None
+    source_cache_dir: Optional[str] = None
+
+def match_length(samples: np.ndarray, num_samples: int) -> np.ndarray:
+    """Trim or zero-pad a mono array to num_samples, as separators may round lengths."""
+    if len(samples) >= num_samples:
+        return samples[:num_samples]
+    return np.pad(samples, (0, num_samples - len(samples)))
+
+def overlapping_blocks(blocks: Iterable[np.ndarray], overlap: int) -> Iterator[np.ndarray]:
+    """Prepend the last overlap samples of each (channels, samples) block to the next one."""
+    tail = None
+    for block in blocks:
+        yield block if tail is None else np.concatenate([tail, block], axis=1)
+        tail = block[:, block.shape[1] - overlap:] if overlap else None
+
+class OverlapAddStitcher:
+    """Joins separated chunks whose first overlap samples repeat the end of the previous chunk.
+
+    The repeated region is crossfaded linearly from the previous chunk into the
+    next, which hides the seam separators leave at hard chunk boundaries. The
+    last overlap samples of every chunk are held back until the next chunk (or
+    flush) arrives, so the stitched output has exactly the input length.
+    """
+
+    def __init__(self, overlap: int):
+        self.overlap = overlap
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def add(self, chunk: np.ndarray) -> np.ndarray:
+        """Take the next mono chunk and return the samples that are now final."""
+        if len(self._tail):
+            n = len(self._tail)
+            fade_in = np.linspace(0.0, 1.0, n + 2, dtype=np.float32)[1:-1]
+            head = self._tail * (1.0 - fade_in) + chunk[:n] * fade_in
+            chunk = np.concatenate([head, chunk[n:]])
+        keep = len(chunk) - min(self.overlap, len(chunk))
+        self._tail = chunk[keep:]
+        return chunk[:keep]
+
+    def flush(self) -> np.ndarray:
+        """Return the held-back end of the last chunk."""
+        tail, self._tail = self._tail, np.zeros(0, dtype=np.float32)
+        return tail
+
+class SeparationCache:
+    """Content-addressed on-disk store of separated chunks.
+
+    Keys hash the chunk samples together with every setting that changes the
+    result, so identical audio is never separated twice, even under another
+    file name. Finished chunks survive a crash, so a restarted run resumes where
+    it stopped. Least recently used entries are evicted beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, chunk: np.ndarray, *params) -> str:
+        digest = hashlib.sha256(repr((chunk.shape, params)).encode())
+        digest.update(np.ascontiguousarray(chunk, dtype='<f4').data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.npy'
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            samples = np.load(path)
+        except (OSError, ValueError):
+            return None
+        # Refresh the mtime, which eviction uses as the last access time
+        os.utime(path)
+        return samples
+
+    def put(self, key: str, samples: np.ndarray):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Write then rename, so concurrent workers never read a partial entry
+        partial_path = path.with_name(f'{key}.{os.getpid()}.partial')
+        with open(partial_path, 'wb') as f:
+            np.save(f, samples)
+        os.replace(partial_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self.cache_dir.glob('*/*.npy'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+class DemucsSeparator:
+    """Demucs model loaded once and run in-process on float32 (channels, samples) arrays."""
+
+    def __init__(self, model_name: str = 'htdemucs_ft', device: Optional[str] = None):
+        import torch
+        from demucs.pretrained import get_model
+
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = get_model(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+        self.sample_rate = self.model.samplerate
+        self.vocals_index = self.model.sources.index('vocals')
+
+    def separate(self, waveform: np.ndarray) -> np.ndarray:
+        """Return the vocals stem of waveform, with the same shape."""
+        import torch
+        from demucs.apply import apply_model
+
+        wav = torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32))
+        if wav.shape[0] != self.model.audio_channels:
+            wav = wav.mean(0, keepdim=True).expand(self.model.audio_channels, -1)
+
+        # Same normalisation as demucs.separate
+        ref = wav.mean(0)
+        mean, std = ref.mean(), ref.std() + 1e-8
+        with torch.no_grad():
+            sources = apply_model(
+                self.model, ((wav - mean) / std)[None],
+                device=self.device, split=True, overlap=0.25, progress=False
+            )[0]
+        vocals = sources[self.vocals_index] * std + mean
+        return vocals.cpu().numpy()
+
+class SpleeterSeparator:
+    """Spleeter 2-stems model loaded once and run in-process on float32 (channels, samples) arrays."""
+
+    def __init__(self, params: str = 'spleeter:2stems'):
+        from spleeter.separator import Separator
+
+        self.separator = Separator(params, multiprocess=False)
+        self.sample_rate = SEPARATION_SAMPLE_RATE
+
+    def separate(self, waveform: np.ndarray) -> np.ndarray:
+        """Return the vocals stem of waveform as a stereo (2, samples) array."""
+        if waveform.shape[0] == 1:
+            waveform = np.repeat(waveform, 2, axis=0)
+        # Spleeter works on (samples, channels)
+        prediction = self.separator.separate(waveform.T)
+        return prediction['vocals'].T.astype(np.float32)
+
+def peak_rss_bytes(who: str = 'self') -> Optional[int]:
+    """Peak resident set size of this process ('self') or its finished children ('children')."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+class SeparationMetrics:
+    """Where separation time goes, chunk by chunk, plus peak memory use.
+
+    Each chunk record has the seconds spent in export (writing the chunk WAV
+    for a subprocess), separation (running the models), reload (reading the
+    separated WAV back) and write (stitching and writing the output), and the
+    peak RSS of the process that separated it. Chunks from the cache only
+    carry write time. Written as JSON, or as Prometheus text for .prom files.
+    """
+
+    STAGES = ('export', 'separation', 'reload', 'write')
+
+    def __init__(self):
+        self.chunks = []
+        self.files = []
+        self._last_chunk = {}
+        self._lock = threading.Lock()
+
+    def record_chunk(self, timings: dict):
+        record = {stage: 0.0 for stage in self.STAGES}
+        record.update(timings)
+        with self._lock:
+            self.chunks.append(record)
+            self._last_chunk[record['file']] = record
+
+    def record_write(self, file_name: str, seconds: float):
+        """Add write time to the most recent chunk of file_name, which is the one being written."""
+        with self._lock:
+            record = self._last_chunk.get(file_name)
+            if record is not None:
+                record['write'] += seconds
+
+    def record_file(self, file_name: str, seconds: float):
+        with self._lock:
+            self.files.append({'file': file_name, 'seconds': seconds})
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {stage: sum(chunk[stage] for chunk in self.chunks) for stage in self.STAGES}
+
+    def to_dict(self) -> dict:
+        totals = self.totals()
+        with self._lock:
+            return {
+                'files': list(self.files),
+                'chunks': [dict(chunk) for chunk in self.chunks],
+                'totals': totals,
+                'cached_chunks': sum(1 for chunk in self.chunks if chunk.get('cached')),
+                'peak_rss_bytes': {'self': peak_rss_bytes('self'), 'children': peak_rss_bytes('children')}
+            }
+
+    def to_prometheus(self) -> str:
+        data = self.to_dict()
+        lines = [
+            '# HELP separation_stage_seconds_total Seconds spent in each separation stage.',
+            '# TYPE separation_stage_seconds_total counter'
+        ]
+        lines += [f'separation_stage_seconds_total{{stage="{stage}"}} {seconds:.3f}'
+                  for stage, seconds in data['totals'].items()]
+        lines += [
+            '# HELP separation_chunks_total Chunks separated, including cache hits.',
+            '# TYPE separation_chunks_total counter',
+            f'separation_chunks_total {len(data["chunks"])}',
+            '# HELP separation_cached_chunks_total Chunks served from the separation cache.',
+            '# TYPE separation_cached_chunks_total counter',
+            f'separation_cached_chunks_total {data["cached_chunks"]}',
+            '# HELP separation_files_total Files separated.',
+            '# TYPE separation_files_total counter',
+            f'separation_files_total {len(data["files"])}',
+            '# HELP separation_peak_rss_bytes Peak resident set size.',
+            '# TYPE separation_peak_rss_bytes gauge'
+        ]
+        lines += [f'separation_peak_rss_bytes{{process="{who}"}} {value}'
+                  for who, value in data['peak_rss_bytes'].items() if value is not None]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Write the metrics to path, as Prometheus text if it ends in .prom and JSON otherwise."""
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        partial_path = f'{path}.partial'
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(partial_path, path)
+
+# Separators loaded inside pool worker processes, kept for the life of the worker
+_worker_separators = {}
 
 class AudioProcessor:
-    def __init__(self, config: ProcessingConfig = ProcessingConfig()):
+    def __init__(self, config: ProcessingConfig = ProcessingConfig(), separators: Optional[dict] = None):
         self.config = config
+        self._executor = None
+        self._separators = {}
+        # Objects with a separate() method used instead of the 'demucs'/'spleeter'
+        # models, e.g. stand-ins for benchmarks. They are pickled to chunk workers.
+        self._separator_overrides = dict(separators or {})
+        self.cache = None
+        if config.cache_dir:
+            self.cache = SeparationCache(config.cache_dir, int(config.cache_max_gb * 1024 ** 3))
+        self.shard_writer = ShardWriter(config.shard_dir) if config.shard_dir else None
+        self.metrics = SeparationMetrics()
         self._setup_logging()
-        self._setup_directories()
         self.logger.info("AudioProcessor initialized with config: %s", config)
 
+    def __getstate__(self):
+        # Chunks are pickled to worker processes along with the processor,
+        # which must not carry the parent's process pool with it
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_separators'] = None
+        state['shard_writer'] = None
+        state['metrics'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Workers share one set of loaded models across all chunks they handle
+        self.__dict__.update(state)
+        self._separators = _worker_separators
+
+    def close(self):
+        """Shut down the chunk worker pool, if one was started, and close the shard writer."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+            self.shard_writer = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Return the worker pool, starting it on first use and keeping it across files.
+
+        Workers are spawned rather than forked: the pool may start from a thread
+        of a process already running torch on other threads (e.g. pipeline.py),
+        and forking such a process can deadlock the child.
+        """
+        if self._executor is None:
+            self.logger.info(f"Starting pool with {self.config.num_workers} chunk workers")
+            self._executor = ProcessPoolExecutor(max_workers=self.config.num_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _use_inprocess(self, mode: str) -> bool:
+        """Whether chunks for mode can be separated in-process, else fall back to subprocesses."""
+        if self.config.separation_backend != 'inprocess':
+            return False
+        required = ['spleeter'] if mode == 'spleeter' else ['demucs', 'spleeter']
+        missing = [
+            name for name in required
+            if name not in self._separator_overrides and importlib.util.find_spec(name) is None
+        ]
+        if missing:
+            self.logger.warning(
+                f"{', '.join(missing)} not importable, falling back to subprocess separation"
+            )
+            return False
+        return True
+
+    def _get_separator(self, name: str):
+        """Return the in-process separator for name, loading the model on first use."""
+        if name in self._separator_overrides:
+            return self._separator_overrides[name]
+        if name not in self._separators:
+            self.logger.info(f"Loading {name} separation model")
+            if name == 'demucs':
+                self._separators[name] = DemucsSeparator(self.config.demucs_model, self.config.device)
+            else:
+                self._separators[name] = SpleeterSeparator()
+        return self._separators[name]
+
+    def _separate_in_process(self, chunk: np.ndarray, mode: str) -> np.ndarray:
+        """Separate a chunk with the resident models, passing arrays between stages."""
+        waveform = chunk
+        if mode == 'demucs':
+            waveform = self._get_separator('demucs').separate(waveform)
+        vocals = self._get_separator('spleeter').separate(waveform)
+        return vocals.mean(axis=0)
+
     def _setup_logging(self):
         """Configure logging with both file and console handlers."""
         self.logger = logging.getLogger('AudioProcessor')
@@ -48,53 +413,95 @@ class AudioProcessor:
 
         # File handler (if log_file is specified)
         if self.config.log_file:
-            file_handler = logging.FileHandler(self.config.log_file)
+            # The log file is only created once something is logged to it
+            file_handler = logging.FileHandler(self.config.log_file, delay=True)
             file_handler.setFormatter(detailed_formatter)
             self.logger.addHandler(file_handler)
 
     def _setup_directories(self):
-        """Create necessary directories if they don't exist."""
+        """Create the working directories of subprocess separation if they don't exist.
+
+        Called before the first chunk is exported, so in-process runs and
+        processors that are never used leave no directories behind.
+        """
         for dir_name in ['spleeter/temp_output', 'demucs/temp_output', 'demucs/output']:
             Path(dir_name).mkdir(parents=True, exist_ok=True)
-        self.logger.debug("Directory setup completed")
 
     def _process_chunk(self, chunk_info: tuple) -> tuple:
-        """Process a single chunk of audio using either Spleeter or Demucs."""
-        chunk, chunk_path, idx, input_file_name, mode = chunk_info
+        """Process a single chunk of audio using either Spleeter or Demucs.
+
+        The chunk is a float32 (channels, samples) array at SEPARATION_SAMPLE_RATE and
+        the result is ``(idx, vocals, timings)`` with the mono vocals array and the
+        chunk's SeparationMetrics record. Only the subprocess backend touches disk.
+        """
+        chunk, chunk_path, idx, input_file_name, temp_id, mode, inprocess = chunk_info
         start_time = time.time()
+        timings = {'file': input_file_name, 'chunk': idx, 'cached': False}
+        if isinstance(chunk, AudioSlice):
+            chunk = chunk.load()
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(
+                chunk, mode, inprocess, self.config.output_bitrate,
+                self.config.demucs_model if mode == 'demucs' else None
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Chunk {idx} loaded from cache")
+                timings['cached'] = True
+                return idx, cached, timings
+
+        # Each chunk gets its own output directories so concurrent workers don't collide
+        chunk_dirs = [f'{stage}/temp_output/{temp_id}_chunk_{idx}' for stage in ('demucs', 'spleeter')]
+        demucs_dir, spleeter_dir = chunk_dirs
         
         try:
-            self.logger.debug(f"Processing chunk {idx}: Duration={len(chunk)}ms, Mode={mode}")
-            
-            # Export chunk to temporary file
-            chunk.export(chunk_path, format='wav')
-            self.logger.debug(f"Chunk {idx} exported to temporary file: {chunk_path}")
-            
-            if mode == 'spleeter':
-                processed = self._spleeter_process_chunk(chunk_path, f'{input_file_name}_temp_chunk_{idx}')
-            else:
-                _ = self._demucs_process_chunk(chunk_path, f'{input_file_name}_temp_chunk_{idx}')
-                spleeter_input_path = f'demucs/temp_output/htdemucs_ft/{input_file_name}_temp_chunk_{idx}/vocals.wav'
-                processed = self._spleeter_process_chunk(spleeter_input_path, 'vocals')
+            duration = chunk.shape[1] / SEPARATION_SAMPLE_RATE
+            self.logger.debug(f"Processing chunk {idx}: Duration={duration:.1f}s, Mode={mode}")
 
-                
+            if inprocess:
+                stage_start = time.time()
+                processed = self._separate_in_process(chunk, mode)
+                timings['separation'] = time.time() - stage_start
+            else:
+                # Export chunk to temporary file
+                stage_start = time.time()
+                self._setup_directories()
+                write_wav(chunk_path, chunk, SEPARATION_SAMPLE_RATE)
+                timings['export'] = time.time() - stage_start
+                self.logger.debug(f"Chunk {idx} exported to temporary file: {chunk_path}")
+
+                if mode == 'spleeter':
+                    processed = self._spleeter_process_chunk(chunk_path, spleeter_dir, timings)
+                else:
+                    model = self.config.demucs_model
+                    self._demucs_process_chunk(chunk_path, demucs_dir, model, timings)
+                    spleeter_input_path = f'{demucs_dir}/{model}/{Path(chunk_path).stem}/vocals.wav'
+                    processed = self._spleeter_process_chunk(spleeter_input_path, spleeter_dir, timings)
+            processed = match_length(processed, chunk.shape[1])
+            timings['peak_rss_bytes'] = peak_rss_bytes()
+
+            if cache_key is not None:
+                self.cache.put(cache_key, processed)
             
             processing_time = time.time() - start_time
             self.logger.info(f"Chunk {idx} processed successfully in {processing_time:.2f} seconds")
             
-            return idx, processed
+            return idx, processed, timings
             
         except Exception as e:
             self.logger.error(f"Error processing chunk {idx}: {str(e)}", exc_info=True)
             raise
         finally:
-            # Clean up temporary chunk file
+            # Clean up temporary chunk file and its separation outputs
             Path(chunk_path).unlink(missing_ok=True)
+            for chunk_dir in chunk_dirs:
+                shutil.rmtree(chunk_dir, ignore_errors=True)
             self.logger.debug(f"Temporary file for chunk {idx} cleaned up")
 
-    def _spleeter_process_chunk(self, input_path: str, basename: str) -> AudioSegment:
-        """Process a chunk using Spleeter."""
-        output_dir = 'spleeter/temp_output'
+    def _spleeter_process_chunk(self, input_path: str, output_dir: str, timings: Optional[dict] = None) -> np.ndarray:
+        """Process a chunk using Spleeter, writing its stems under output_dir."""
         cmd = [
             'python', '-m', 'spleeter', 'separate',
             input_path, '-o', output_dir, '-c', 'wav',
@@ -102,11 +509,11 @@ class AudioProcessor:
         ]
         
         self.logger.debug(f"Running Spleeter command: {' '.join(cmd)}")
-        return self._run_separation_command(cmd, f'{output_dir}/{basename}/vocals.wav')
+        return self._run_separation_command(cmd, f'{output_dir}/{Path(input_path).stem}/vocals.wav', timings=timings)
 
-    def _demucs_process_chunk(self, input_path: str, basename: str, model='htdemucs_ft') -> AudioSegment:
-        """Process a chunk using Demucs."""
-        output_dir = 'demucs/temp_output'
+    def _demucs_process_chunk(self, input_path: str, output_dir: str, model='htdemucs_ft',
+                              timings: Optional[dict] = None) -> np.ndarray:
+        """Process a chunk using Demucs, writing its stems under output_dir."""
         cmd = [
             'python', '-m', 'demucs.separate',
             '-n', model, '-o', output_dir,
@@ -116,14 +523,21 @@ class AudioProcessor:
         ]
         
         self.logger.debug(f"Running Demucs command: {' '.join(cmd)}")
-        return self._run_separation_command(cmd, f'{output_dir}/{model}/{basename}/vocals.wav')
+        return self._run_separation_command(cmd, f'{output_dir}/{model}/{Path(input_path).stem}/vocals.wav',
+                                            timings=timings)
+
 
+    def _run_separation_command(self, cmd: List[str], output_path: str, max_retries: int = 3,
+                                timings: Optional[dict] = None) -> np.ndarray:
+        """Execute separation command with retries and return processed mono audio.
 
-    def _run_separation_command(self, cmd: List[str], output_path: str, max_retries: int = 3) -> AudioSegment:
-        """Execute separation command with retries and return processed audio."""
+        Time spent running the command and reading its output back is added to
+        the 'separation' and 'reload' entries of timings.
+        """
         for attempt in range(max_retries):
             try:
                 self.logger.debug(f"Attempt {attempt + 1}/{max_retries}")
+                stage_start = time.time()
                 
                 # Create process with pipe for real-time output
                 process = subprocess.Popen(
@@ -135,52 +549,64 @@ class AudioProcessor:
                     universal_newlines=True
                 )
 
-                # Handle output in real-time
-                while True:
-                    # Read stdout
-                    stdout_line = process.stdout.readline()
-                    if stdout_line:
-                        stdout_line = stdout_line.rstrip()
-                        print(stdout_line, flush=True)  # Print to console
-                        self.logger.debug(f"Command stdout: {stdout_line}")  # Log to file
-
-                    # Read stderr
-                    stderr_line = process.stderr.readline()
-                    if stderr_line:
-                        stderr_line = stderr_line.rstrip()
-                        print(stderr_line, file=sys.stderr, flush=True)  # Print to console
-                        self.logger.debug(f"Command stderr: {stderr_line}")  # Log to file
-
-                    # Check if process has finished
-                    if process.poll() is not None:
-                        break
-
-                # Get return code
+                # Drain both pipes at once, so neither can fill up and block the command
+                tail = deque(maxlen=ERROR_TAIL_LINES)
+                drains = [
+                    threading.Thread(target=self._drain_pipe, args=(process.stdout, sys.stdout, 'stdout', tail), daemon=True),
+                    threading.Thread(target=self._drain_pipe, args=(process.stderr, sys.stderr, 'stderr', tail), daemon=True)
+                ]
+                for drain in drains:
+                    drain.start()
                 return_code = process.wait()
+                for drain in drains:
+                    drain.join()
+                if timings is not None:
+                    timings['separation'] = timings.get('separation', 0.0) + time.time() - stage_start
                 
                 if return_code != 0:
-                    raise subprocess.CalledProcessError(return_code, cmd)
+                    raise subprocess.CalledProcessError(return_code, cmd, output='\n'.join(tail))
 
                 # Check if output file exists
                 if not os.path.exists(output_path):
                     raise FileNotFoundError(f"Output file not found: {output_path}")
 
-                return AudioSegment.from_file(output_path).set_channels(1)
+                stage_start = time.time()
+                output, _ = load_audio(output_path, SEPARATION_SAMPLE_RATE, channels=1)
+                if timings is not None:
+                    timings['reload'] = timings.get('reload', 0.0) + time.time() - stage_start
+                return output
                 
             except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                self.logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
+                details = f"\n{e.output}" if getattr(e, 'output', None) else ""
+                self.logger.warning(f"Attempt {attempt + 1} failed: {str(e)}{details}")
                 if attempt == max_retries - 1:
                     self.logger.error(f"All {max_retries} attempts failed", exc_info=True)
                     raise RuntimeError(f"Failed to process chunk after {max_retries} attempts") from e
                 continue
 
+    def _drain_pipe(self, pipe, console, name: str, tail: deque):
+        """Echo a command's output pipe to the console until it closes, logging all but progress bars."""
+        with pipe:
+            for line in pipe:
+                line = line.rstrip()
+                if not line:
+                    continue
+                print(line, file=console, flush=True)
+                if not PROGRESS_LINE.search(line):
+                    self.logger.debug(f"Command {name}: {line}")
+                    tail.append(line)
+
 
     def remove_background_music(
         self,
         input_file_path: str,
         mode: Literal['spleeter', 'demucs'] = 'demucs'
     ) -> str:
-        """Remove background music from audio file using specified method."""
+        """Remove background music from audio file using specified method.
+
+        Returns the path of the vocals WAV. With shard_dir set, the vocals are
+        packed into the shard instead and that path is their utterance id.
+        """
         start_time = time.time()
         self.logger.info(f"Starting background music removal: {input_file_path}")
         
@@ -190,47 +616,68 @@ class AudioProcessor:
         output_path = input_path.with_stem(f"{input_path.stem}_vocals")  # Save with _vocals extension in the same directory
         
         # Check if output already exists
-        if output_path.exists():
+        if output_path.exists() or (self.shard_writer is not None and str(output_path) in self.shard_writer):
             self.logger.info(f"Skipping file {input_path.stem}. Vocals file exists.")
             return str(output_path)
 
-        # Load and prepare audio
-        self.logger.info("Loading input audio file")
-        audio = AudioSegment.from_file(input_file_path)
-        chunk_duration = int(self.config.chunk_duration_minutes * 60 * 1000)
-        
-        # Prepare chunks for processing
-        chunks_info = [
+        chunk_samples = int(self.config.chunk_duration_minutes * 60 * SEPARATION_SAMPLE_RATE)
+        overlap_samples = int(self.config.overlap_seconds * SEPARATION_SAMPLE_RATE)
+        if overlap_samples >= chunk_samples:
+            raise ValueError("overlap_seconds must be shorter than the chunk duration")
+        inprocess = self._use_inprocess(mode)
+
+        # Every chunk after the first also covers the last overlap_samples of the
+        # previous one, which OverlapAddStitcher crossfades when writing the output
+        if self.config.streaming:
+            # Decode one chunk at a time, so memory doesn't grow with input length
+            self.logger.info("Streaming input audio file")
+            blocks = overlapping_blocks(
+                iter_audio_blocks(input_file_path, chunk_samples, SEPARATION_SAMPLE_RATE, channels=2),
+                overlap_samples
+            )
+        elif self.config.source_cache_dir:
+            # Decode once into a shared raw cache file; chunks are references into its
+            # memmap, which pool workers read directly instead of receiving copies
+            self.logger.info("Opening memory-mapped input audio")
+            source = AudioSource(input_file_path, SEPARATION_SAMPLE_RATE, channels=2,
+                                 cache_dir=self.config.source_cache_dir)
+            blocks = [
+                AudioSlice(source, max(0, i - overlap_samples), i + chunk_samples)
+                for i in range(0, len(source), chunk_samples)
+            ]
+            self.logger.info(f"Audio split into {len(blocks)} chunks")
+        else:
+            # Decode once; every chunk below is a view into this array
+            self.logger.info("Loading input audio file")
+            audio, _ = load_audio(input_file_path, SEPARATION_SAMPLE_RATE, channels=2)
+            blocks = [
+                audio[:, max(0, i - overlap_samples):i + chunk_samples]
+                for i in range(0, audio.shape[1], chunk_samples)
+            ]
+            self.logger.info(f"Audio split into {len(blocks)} chunks")
+
+        # Temporary files are named per call, so files sharing a name in different
+        # directories (spk1/001.wav, spk2/001.wav) can be separated at the same time
+        temp_id = f'{input_path.stem}_{uuid.uuid4().hex[:8]}'
+        chunks_info = (
             (
-                audio[i:min(i + chunk_duration, len(audio))],
-                f'{mode}/{input_path.stem}_temp_chunk_{idx}.wav',
+                block,
+                f'{mode}/{temp_id}_temp_chunk_{idx}.wav',
                 idx,
                 input_path.stem,
-                mode
+                temp_id,
+                mode,
+                inprocess
             )
-            for idx, i in enumerate(range(0, len(audio), chunk_duration))
-        ]
-        
-        total_chunks = len(chunks_info)
-        self.logger.info(f"Audio split into {total_chunks} chunks")
+            for idx, block in enumerate(blocks)
+        )
 
         try:
-            # Process chunks sequentially
-            processed_chunks = []
-            for chunk_info in chunks_info:
-                idx, processed_chunk = self._process_chunk(chunk_info)
-                processed_chunks.append(processed_chunk)
-                self.logger.info(f"Chunk {idx + 1}/{total_chunks} completed")
-
-            # Concatenate and export
-            self.logger.info("Concatenating processed chunks")
-            final_audio = sum(processed_chunks[1:], processed_chunks[0])
-            
-            self.logger.info(f"Exporting final audio to {output_path}")
-            final_audio.set_channels(1)
-            final_audio.export(output_path, format='wav')
+            self.logger.info(f"Writing final audio to {output_path}")
+            self._write_output(output_path, self._iter_processed_chunks(chunks_info), overlap_samples, str(input_path))
             
             total_time = time.time() - start_time
+            self.metrics.record_file(input_path.stem, total_time)
             self.logger.info(f"Processing completed in {total_time:.2f} seconds")
             
             return str(output_path)
@@ -240,17 +687,95 @@ class AudioProcessor:
             raise
         finally:
             # Clean up temporary files
-            self._cleanup_temp_files(mode)
+            self._cleanup_temp_files(mode, temp_id)
+
+    def _write_output(self, output_path: Path, processed_chunks: Iterable[np.ndarray],
+                      overlap_samples: int = 0, source: Optional[str] = None):
+        """Write processed chunks to output_path as they arrive, without concatenating them.
 
-    def _cleanup_temp_files(self, mode: str):
-        """Clean up all temporary files and directories."""
+        Chunks overlapping by overlap_samples are crossfaded at their seams.
+
+        The file is written under a temporary name and renamed at the end, so an
+        interrupted run never leaves a partial vocals file that would be skipped later.
+        With a shard writer, the temporary file is copied into the shard once
+        complete, so the shard is only locked for the copy and not while the
+        chunks are being separated.
+        """
+        partial_path = output_path.with_name(output_path.name + '.partial')
+        try:
+            with WavWriter(partial_path, SEPARATION_SAMPLE_RATE) as writer:
+                self._write_stitched(writer, processed_chunks, overlap_samples, source)
+            if self.shard_writer is not None:
+                self.shard_writer.add_wav(str(output_path), partial_path, source=source)
+                partial_path.unlink()
+                return
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+        os.replace(partial_path, output_path)
+
+    def _write_stitched(self, writer, processed_chunks: Iterable[np.ndarray], overlap_samples: int,
+                        source: Optional[str] = None):
+        stitcher = OverlapAddStitcher(overlap_samples)
+        file_name = Path(source).stem if source else None
+        for processed_chunk in processed_chunks:
+            stage_start = time.time()
+            writer.write(stitcher.add(processed_chunk))
+            self.metrics.record_write(file_name, time.time() - stage_start)
+        stage_start = time.time()
+        writer.write(stitcher.flush())
+        self.metrics.record_write(file_name, time.time() - stage_start)
+
+    def _iter_processed_chunks(self, chunks_info: Iterable[tuple]) -> Iterator[np.ndarray]:
+        """Separate chunks and yield the results in index order.
+
+        With num_workers > 1, chunks run concurrently in the process pool. At most
+        2 * num_workers are in flight, so a slow chunk holds back only a bounded
+        number of finished ones and memory stays flat for any input length.
+        """
+        if self.config.num_workers <= 1:
+            for chunk_info in chunks_info:
+                idx, processed_chunk, timings = self._process_chunk(chunk_info)
+                self.metrics.record_chunk(timings)
+                self.logger.info(f"Chunk {idx + 1} completed")
+                yield processed_chunk
+            return
+
+        executor = self._get_executor()
+        max_in_flight = 2 * self.config.num_workers
+        pending = deque()
+        try:
+            for chunk_info in chunks_info:
+                pending.append(executor.submit(self._process_chunk, chunk_info))
+                if len(pending) >= max_in_flight:
+                    yield self._chunk_result(pending.popleft())
+            while pending:
+                yield self._chunk_result(pending.popleft())
+        finally:
+            # Drop queued chunks if a chunk failed or the consumer stopped early
+            for future in pending:
+                future.cancel()
+
+    def _chunk_result(self, future) -> np.ndarray:
+        idx, processed_chunk, timings = future.result()
+        self.metrics.record_chunk(timings)
+        self.logger.info(f"Chunk {idx + 1} completed")
+        return processed_chunk
+
+    def _cleanup_temp_files(self, mode: str, temp_id: str):
+        """Clean up the temporary files and directories left by one remove_background_music call.
+
+        Only that call's chunks are touched, so other files being separated
+        concurrently keep their temporary outputs.
+        """
         self.logger.debug("Cleaning up temporary files")
-        temp_output = Path(f'{mode}/temp_output')
+        # Demucs mode also runs Spleeter on the Demucs vocals
+        stages = ['spleeter'] if mode == 'spleeter' else ['demucs', 'spleeter']
+        for stage in stages:
+            for chunk_dir in Path(f'{stage}/temp_output').glob(f'{glob.escape(temp_id)}_chunk_*'):
+                shutil.rmtree(chunk_dir, ignore_errors=True)
         
-        if temp_output.exists():
-            shutil.rmtree(temp_output)
-        
-        temp_files = Path(mode).glob('*.wav')
+        temp_files = Path(mode).glob(f'{glob.escape(temp_id)}_temp_chunk_*.wav')
         for temp_file in temp_files:
             temp_file.unlink(missing_ok=True)
         
@@ -284,6 +809,13 @@ def parse_args():
         help='Duration of each chunk in minutes'
     )
 
+    parser.add_argument(
+        '--overlap',
+        type=float,
+        default=0.0,
+        help='Seconds of overlap between consecutive chunks, crossfaded when stitching'
+    )
+
     parser.add_argument(
         '--bitrate',
         type=str,
@@ -291,6 +823,69 @@ def parse_args():
         help='Output audio bitrate'
     )
 
+    parser.add_argument(
+        '--backend',
+        type=str,
+        choices=['inprocess', 'subprocess'],
+        default='inprocess',
+        help='Run separation models in-process (loaded once) or as a python -m subprocess per chunk'
+    )
+
+    parser.add_argument(
+        '--device',
+        type=str,
+        default=None,
+        help='Torch device for in-process Demucs (default: cuda if available)'
+    )
+
+    parser.add_argument(
+        '-j', '--workers',
+        type=int,
+        default=1,
+        help='Number of chunks separated concurrently, each in its own process'
+    )
+
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Decode, separate and write one chunk at a time to keep memory flat on long recordings'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help='Directory for cached separated chunks; reruns skip chunks already separated'
+    )
+
+    parser.add_argument(
+        '--cache-max-gb',
+        type=float,
+        default=20.0,
+        help='Size limit of the chunk cache before least recently used entries are evicted'
+    )
+
+    parser.add_argument(
+        '--shard-dir',
+        type=str,
+        default=None,
+        help='Pack vocals into shards in this directory instead of writing loose WAV files'
+    )
+
+    parser.add_argument(
+        '--source-cache-dir',
+        type=str,
+        default=None,
+        help='Keep decoded inputs here as raw PCM and read them memory-mapped, shared across runs and workers'
+    )
+
+    parser.add_argument(
+        '--metrics-file',
+        type=str,
+        default=None,
+        help='Write per-chunk stage timings and peak memory here, as Prometheus text for .prom files and JSON otherwise'
+    )
+
     parser.add_argument(
         '--log-level',
         type=str,
@@ -353,9 +948,19 @@ def main():
         chunk_duration_minutes=args.chunk_duration,
         output_bitrate=args.bitrate,
         log_level=args.log_level,
-        log_file=None if args.log_file.lower() == 'none' else args.log_file
+        log_file=None if args.log_file.lower() == 'none' else args.log_file,
+        num_workers=args.workers,
+        separation_backend=args.backend,
+        device=args.device,
+        streaming=args.streaming,
+        overlap_seconds=args.overlap,
+        cache_dir=args.cache_dir,
+        cache_max_gb=args.cache_max_gb,
+        shard_dir=args.shard_dir,
+        source_cache_dir=args.source_cache_dir
     )
 
+    processor = None
     try:
         processor = AudioProcessor(config)
         start_time = time.time()
@@ -375,10 +980,18 @@ def main():
         print("\nProcessed files:")
         for file_path in processed_files:
             print(f"- {file_path}")
+        print("\nTime by stage:")
+        for stage, seconds in processor.metrics.totals().items():
+            print(f"- {stage}: {seconds:.2f} seconds")
 
     except Exception as e:
         print(f"\nError: {str(e)}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if processor is not None:
+            if args.metrics_file:
+                processor.metrics.write(args.metrics_file)
+            processor.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+from audio_io import convert_audio_file, load_audio, write_wav
+from audio_separation import AudioProcessor, ProcessingConfig, peak_rss_bytes
+from vad import CONTEXT_SIZE, VAD
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_SAMPLE_RATE = 44100
+ASR_SAMPLE_RATE = 16000
+
+# Fixtures: synthetic speech over music, deterministic for a given seed
+def synth_speech(num_samples, sample_rate, rng):
+    """Speech-like signal: harmonic 'utterances' with a wandering pitch and a syllable-rate envelope, between pauses."""
+    speech = np.zeros(num_samples, dtype=np.float32)
+    pos = 0
+    while pos < num_samples:
+        pos += int(rng.uniform(0.2, 0.8) * sample_rate)
+        length = min(int(rng.uniform(0.5, 2.5) * sample_rate), num_samples - pos)
+        if length <= 0:
+            break
+        t = np.arange(length) / sample_rate
+        f0 = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        syllables = 0.5 * (1 - np.cos(2 * np.pi * 4 * t))
+        speech[pos:pos + length] = 0.3 * voiced * syllables
+        pos += length
+    return speech
+
+def synth_music(num_samples, sample_rate, rng, note_seconds=0.5):
+    """Music-like signal: decaying three-note chords on a beat, with noise hi-hats."""
+    music = np.zeros(num_samples, dtype=np.float32)
+    note_samples = int(note_seconds * sample_rate)
+    t = np.arange(note_samples) / sample_rate
+    decay = np.exp(-4 * t)
+    hihat = rng.standard_normal(note_samples // 8) * np.exp(-60 * t[:note_samples // 8])
+    for start in range(0, num_samples, note_samples):
+        root = 220 * 2 ** (rng.integers(0, 12) / 12)
+        chord = sum(np.sin(2 * np.pi * root * ratio * t) for ratio in (1, 1.25, 1.5)) / 3
+        note = 0.2 * chord * decay
+        note[:len(hihat)] += 0.05 * hihat
+        end = min(start + note_samples, num_samples)
+        music[start:end] = note[:end - start]
+    return music
+
+def make_fixture(path, seconds, sample_rate=FIXTURE_SAMPLE_RATE, seed=0):
+    """Write a stereo WAV of speech mixed over music, panned apart so separation has work to do."""
+    rng = np.random.default_rng(seed)
+    num_samples = int(seconds * sample_rate)
+    speech = synth_speech(num_samples, sample_rate, rng)
+    music = synth_music(num_samples, sample_rate, rng)
+    write_wav(path, np.stack([speech + 0.6 * music, speech + 0.4 * music]), sample_rate)
+    return path
+
+# Stand-in models: cheap, deterministic, no downloads and no GPU
+class StandInSeparator:
+    """Separator with the DemucsSeparator/SpleeterSeparator interface: a moving-average low-pass per channel."""
+
+    def __init__(self, width=32):
+        self.width = width
+
+    def separate(self, waveform):
+        waveform = np.asarray(waveform, dtype=np.float32)
+        padded = np.pad(waveform, ((0, 0), (self.width, 0)))
+        cumsum = np.cumsum(padded, axis=1, dtype=np.float64)
+        return ((cumsum[:, self.width:] - cumsum[:, :-self.width]) / self.width).astype(np.float32)
+
+class StandInVADSession:
+    """Replaces the Silero ONNX session: speech probability from frame energy."""
+
+    def run(self, output_names, inputs):
+        frames = inputs['input'][:, CONTEXT_SIZE:]
+        level_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        probs = 1 / (1 + np.exp(-(level_db + 30) / 3))
+        return probs.reshape(-1, 1).astype(np.float32), inputs['state']
+
+class StandInVADPool:
+    """Session pool handing out one StandInVADSession, for ``VAD(backend='onnx', session_pool=...)``."""
+
+    def __init__(self):
+        self._session = StandInVADSession()
+
+    @contextmanager
+    def session(self):
+        yield self._session
+
+def tiny_wav2vec(workdir):
+    """A randomly initialised two-layer wav2vec2 CTC model and processor, built offline."""
+    import torch
+    from transformers import (Wav2Vec2Config, Wav2Vec2CTCTokenizer, Wav2Vec2FeatureExtractor,
+                              Wav2Vec2ForCTC, Wav2Vec2Processor)
+
+    vocab = {"<pad>": 0, "<unk>": 1, "|": 2}
+    vocab.update({char: idx for idx, char in enumerate("ابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی", len(vocab))})
+    vocab_path = os.path.join(workdir, "vocab.json")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+    processor = Wav2Vec2Processor(
+        feature_extractor=Wav2Vec2FeatureExtractor(
+            feature_size=1, sampling_rate=ASR_SAMPLE_RATE, padding_value=0.0,
+            do_normalize=True, return_attention_mask=True
+        ),
+        tokenizer=Wav2Vec2CTCTokenizer(vocab_path, unk_token="<unk>", pad_token="<pad>", word_delimiter_token="|")
+    )
+    torch.manual_seed(0)
+    config = Wav2Vec2Config(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, conv_dim=(32,) * 7, num_conv_pos_embeddings=16, pad_token_id=0
+    )
+    return processor, Wav2Vec2ForCTC(config).eval()
+
+# Stages: each factory returns a function that processes one fixture file
+def decode_stage(workdir, args):
+    return lambda path: load_audio(path, ASR_SAMPLE_RATE, channels=1)
+
+def convert_stage(workdir, args):
+    output_path = os.path.join(workdir, "converted.wav")
+    return lambda path: convert_audio_file(path, output_path, ASR_SAMPLE_RATE, channels=1)
+
+def separation_stage(workdir, args):
+    processor = AudioProcessor(
+        ProcessingConfig(chunk_duration_minutes=args.chunk_minutes, num_workers=args.workers,
+                         overlap_seconds=args.overlap, log_level="WARNING", log_file=None),
+        separators={"demucs": StandInSeparator(), "spleeter": StandInSeparator()}
+    )
+
+    def separate(path):
+        output_path = processor.remove_background_music(path, "demucs")
+        # Remove the output, or the next run would skip the file
+        os.remove(output_path)
+
+    return separate
+
+def vad_stage(workdir, args):
+    vad = VAD(backend="onnx", session_pool=StandInVADPool())
+    return lambda path: vad.get_speech_timestamps(vad.read_audio(path))
+
+def asr_stage(workdir, args):
+    from asr_transcriber import wav2vec_long_transcribe
+
+    processor, model = tiny_wav2vec(workdir)
+    return lambda path: wav2vec_long_transcribe(path, processor, model, window_seconds=args.asr_window)
+
+STAGES = {
+    "decode": decode_stage,
+    "convert": convert_stage,
+    "separation": separation_stage,
+    "vad": vad_stage,
+    "asr": asr_stage,
+}
+
+def measure(fn, fixtures, repeats=3, warmup=1):
+    """Time fn over every fixture, then run it once more under tracemalloc for peak memory.
+
+    Memory is traced in a separate pass because tracing slows down Python code.
+    The traced peak counts Python and NumPy allocations made by the stage; the
+    RSS figure is the process-wide peak so far, which includes earlier stages.
+    """
+    for _ in range(warmup):
+        fn(fixtures[0][0])
+
+    latencies = []
+    for _ in range(repeats):
+        for path, _ in fixtures:
+            start_time = time.perf_counter()
+            fn(path)
+            latencies.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    try:
+        for path, _ in fixtures:
+            fn(path)
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    audio_seconds = repeats * sum(seconds for _, seconds in fixtures)
+    wall_seconds = sum(latencies)
+    p50, p90, p99 = (float(value) for value in np.percentile(latencies, [50, 90, 99]) * 1000)
+    return {
+        "runs": len(latencies),
+        "audio_seconds": audio_seconds,
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput": round(audio_seconds / wall_seconds, 3),
+        "latency_ms": {"p50": round(p50, 2), "p90": round(p90, 2), "p99": round(p99, 2)},
+        "peak_traced_bytes": peak_traced,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+def git_revision():
+    """Short commit hash of the working tree, marked -dirty when tracked files have changes."""
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, check=True,
+                             capture_output=True, text=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{rev}-dirty" if status else rev
+
+@contextmanager
+def working_directory(path):
+    # AudioProcessor keeps its temporary chunks under the current directory
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def run_benchmarks(args):
+    revision = git_revision()
+    workdir = tempfile.mkdtemp(prefix="speech_dataset_bench_")
+    results = {}
+    try:
+        fixtures = []
+        for idx in range(args.fixtures):
+            path = make_fixture(os.path.join(workdir, f"fixture_{idx}.wav"), args.seconds, seed=args.seed + idx)
+            fixtures.append((path, args.seconds))
+        print(f"Generated {len(fixtures)} fixtures of {args.seconds}s in {workdir}")
+
+        with working_directory(workdir):
+            for name in args.stages:
+                try:
+                    fn = STAGES[name](workdir, args)
+                except ImportError as e:
+                    print(f"Skipping {name}: {e}")
+                    continue
+                results[name] = measure(fn, fixtures, args.repeats, args.warmup)
+                print_stage(name, results[name])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "revision": revision,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("func", "results_dir", "no_save")},
+        "stages": results,
+    }
+    if not args.no_save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        result_path = os.path.join(args.results_dir, f"{revision}.json")
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {result_path}")
+    return report
+
+def print_stage(name, result):
+    latency = result["latency_ms"]
+    print(f"{name:<12} {result['throughput']:>9.2f}x realtime  "
+          f"p50 {latency['p50']:.1f} ms  p90 {latency['p90']:.1f} ms  p99 {latency['p99']:.1f} ms  "
+          f"peak traced {result['peak_traced_bytes'] / 1024 ** 2:.1f} MiB")
+
+def load_report(name, results_dir):
+    """Load results by file path or by revision name in results_dir."""
+    path = name if os.path.exists(name) else os.path.join(results_dir, f"{name}.json")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def compare_reports(base, head, threshold=0.1):
+    """Print per-stage changes from base to head, returning the stages that regressed beyond threshold.
+
+    A stage regresses when its throughput drops, or its p50 latency or traced
+    peak memory grows, by more than threshold (a fraction).
+    """
+    regressions = []
+    print(f"{'stage':<12} {'throughput':>12} {'p50':>10} {'peak mem':>10}   ({base['revision']} -> {head['revision']})")
+    for name in base["stages"]:
+        if name not in head["stages"]:
+            continue
+        old, new = base["stages"][name], head["stages"][name]
+        throughput = new["throughput"] / old["throughput"] - 1
+        p50 = new["latency_ms"]["p50"] / old["latency_ms"]["p50"] - 1
+        memory = new["peak_traced_bytes"] / max(old["peak_traced_bytes"], 1) - 1
+        regressed = throughput < -threshold or p50 > threshold or memory > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<12} {throughput:>+11.1%} {p50:>+9.1%} {memory:>+9.1%}   {'REGRESSION' if regressed else ''}")
+    return regressions
+
+def compare_benchmarks(args):
+    base = load_report(args.base, args.results_dir)
+    head = load_report(args.head, args.results_dir)
+    regressions = compare_reports(base, head, args.threshold)
+    if regressions:
+        print(f"Regressed beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+# Startup: CLIs must parse arguments without importing any model backend
+STARTUP_COMMANDS = {
+    "asr_transcriber": ["asr_transcriber.py", "--help"],
+    "audio_separation": ["audio_separation.py", "--help"],
+    "pipeline": ["pipeline.py", "--help"],
+}
+HEAVY_MODULES = ("torch", "torchaudio", "librosa", "transformers", "speechbrain", "hezar", "vosk",
+                 "demucs", "spleeter", "onnxruntime", "silero_vad")
+
+def startup_ms(command, repeats=5):
+    """Median wall time in milliseconds of running a repo script in a fresh interpreter."""
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=REPO_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start_time) * 1000)
+    return float(np.median(times))
+
+def heavy_imports(module):
+    """Heavy backend modules that importing module pulls in."""
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True,
+                            capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def check_startup(args):
+    """Fail when a CLI takes longer than the budget to print --help, or imports a model backend to do so."""
+    failures = []
+    for name, command in STARTUP_COMMANDS.items():
+        elapsed = startup_ms(command, args.repeats)
+        imported = heavy_imports(name)
+        ok = elapsed <= args.budget_ms and not imported
+        if not ok:
+            failures.append(name)
+        details = f", imports {', '.join(imported)}" if imported else ""
+        print(f"{name:<18} {elapsed:>8.1f} ms{details}   {'ok' if ok else 'OVER BUDGET'}")
+    if failures:
+        print(f"Startup budget of {args.budget_ms:.0f} ms exceeded by: {', '.join(failures)}")
+        sys.exit(1)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of the conversion, separation, VAD and ASR stages on synthetic audio, "
+                    "and a CLI startup time check.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run the benchmarks and save results for the current commit",
+                                formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    run.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to benchmark")
+    run.add_argument("--seconds", type=float, default=60.0, help="Length of each fixture")
+    run.add_argument("--fixtures", type=int, default=3, help="Number of fixtures")
+    run.add_argument("--seed", type=int, default=0, help="Seed of the first fixture")
+    run.add_argument("--repeats", type=int, default=3, help="Timed passes over the fixtures")
+    run.add_argument("--warmup", type=int, default=1, help="Untimed runs before timing")
+    run.add_argument("--chunk-minutes", type=float, default=0.5, help="Separation chunk duration")
+    run.add_argument("--overlap", type=float, default=0.0, help="Separation chunk overlap in seconds")
+    run.add_argument("--workers", type=int, default=1, help="Separation chunk worker processes")
+    run.add_argument("--asr-window", type=float, default=30.0, help="Long-form ASR window in seconds")
+    run.add_argument("--results-dir", default="benchmark_results", help="Directory of saved results")
+    run.add_argument("--no-save", action="store_true", help="Print results without saving them")
+    run.set_defaults(func=run_benchmarks)
+
+    compare = subparsers.add_parser("compare", help="Compare two saved results",
+                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    compare.add_argument("base", help="Baseline revision or results file")
+    compare.add_argument("head", help="Revision or results file to check")
+    compare.add_argument("--results-dir", default="benchmark_results", help="Directory of saved results")
+    compare.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    compare.set_defaults(func=compare_benchmarks)
+
+    startup = subparsers.add_parser("startup", help="Check CLI startup time against a budget",
+                                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    startup.add_argument("--budget-ms", type=float, default=500.0, help="Longest allowed median --help time")
+    startup.add_argument("--repeats", type=int, default=5, help="Runs per command")
+    startup.set_defaults(func=check_startup)
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,277 @@
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
-from google.colab import auth
-from oauth2client.client import GoogleCredentials
 import os
+import json
+import time
+import ssl
+import random
+import socket
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jsonl import iter_jsonl, open_jsonl_for_append
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+# HTTP statuses worth retrying: timeouts, rate limits and server errors
+TRANSIENT_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
+# Network errors worth retrying; other local errors (missing file, no permission) are not
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, ssl.SSLError,
+                    http.client.HTTPException)
 
 # Authenticate and initialize the pydrive2 client
 def initialize_drive():
+    # Imported here so the upload helpers also work outside Colab, e.g. with a fake client
+    from pydrive2.auth import GoogleAuth
+    from pydrive2.drive import GoogleDrive
+    from google.colab import auth
+    from oauth2client.client import GoogleCredentials
+
     auth.authenticate_user()
     gauth = GoogleAuth()
     gauth.credentials = GoogleCredentials.get_application_default()
     return GoogleDrive(gauth)
 
+def http_status(error):
+    """HTTP status of a googleapiclient HttpError or pydrive2 ApiRequestError, else None."""
+    resp = getattr(error, 'resp', None)
+    if resp is not None:
+        return getattr(resp, 'status', None)
+    details = getattr(error, 'error', None)
+    if isinstance(details, dict):
+        return details.get('code')
+    return None
+
+def is_transient_error(error):
+    try:
+        status = int(http_status(error))
+    except (TypeError, ValueError):
+        status = None
+    return status in TRANSIENT_HTTP_STATUSES or isinstance(error, TRANSIENT_ERRORS)
+
+# Retry a Drive call with exponential backoff and jitter, on transient errors only
+def with_retries(fn, retries=5, base_delay=1.0, max_delay=60.0):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not is_transient_error(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Drive call failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+# Drive's HTTP client isn't thread-safe, so each upload thread authorizes its own
+_thread_local = threading.local()
+
+def _request_param(drive):
+    """Per-thread ``param`` for pydrive2 calls, or None for clients without pydrive2 auth."""
+    get_http = getattr(getattr(drive, 'auth', None), 'Get_Http_Object', None)
+    if get_http is None:
+        return None
+    if getattr(_thread_local, 'drive', None) is not drive:
+        _thread_local.drive = drive
+        _thread_local.http = get_http()
+    return {'http': _thread_local.http}
+
+class FolderCache:
+    """Folder ids by (parent id, name), kept in memory and optionally in a JSON file.
+
+    Saves a ListFile query per lookup; with a cache_path, later runs skip them too.
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self._ids = {}
+        self._lock = threading.Lock()
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, encoding='utf-8') as f:
+                self._ids = json.load(f)
+
+    @staticmethod
+    def _key(parent_folder_id, folder_name):
+        return f'{parent_folder_id}/{folder_name}'
+
+    def get(self, parent_folder_id, folder_name):
+        return self._ids.get(self._key(parent_folder_id, folder_name))
+
+    def set(self, parent_folder_id, folder_name, folder_id):
+        self._ids[self._key(parent_folder_id, folder_name)] = folder_id
+        if self.cache_path:
+            partial_path = f'{self.cache_path}.partial'
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                json.dump(self._ids, f)
+            os.replace(partial_path, self.cache_path)
+
+class UploadLedger:
+    """Append-only JSON-lines record of finished uploads, so reruns skip them.
+
+    A file counts as uploaded while its size and mtime match the entry for the
+    same destination folder. A torn last line from an interrupted run is ignored.
+    """
+
+    def __init__(self, ledger_path):
+        self.ledger_path = ledger_path
+        self.entries = {}
+        for entry in iter_jsonl(ledger_path):
+            self.entries[(entry['path'], entry['folder_id'])] = entry
+        self._file = open_jsonl_for_append(ledger_path)
+        self._lock = threading.Lock()
+
+    def file_id(self, file_path, parent_folder_id):
+        """Drive id of file_path if it was uploaded to parent_folder_id unchanged, else None."""
+        entry = self.entries.get((os.path.abspath(file_path), parent_folder_id))
+        if entry is None:
+            return None
+        stat = os.stat(file_path)
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            return None
+        return entry['file_id']
+
+    def record(self, file_path, parent_folder_id, file_id):
+        stat = os.stat(file_path)
+        entry = {
+            'path': os.path.abspath(file_path),
+            'folder_id': parent_folder_id,
+            'file_id': file_id,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._file.flush()
+            self.entries[(entry['path'], parent_folder_id)] = entry
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 # Function to create a folder on Google Drive
 def create_folder(drive, parent_folder_id, subfolder_name):
     new_folder = drive.CreateFile({
         'title': subfolder_name,
         'parents': [{'id': parent_folder_id}],
-        'mimeType': 'application/vnd.google-apps.folder'
+        'mimeType': FOLDER_MIME_TYPE
     })
     new_folder.Upload()
     return new_folder
 
 # Function to get or create a folder
-def get_or_create_folder(drive, parent_folder_id, folder_name):
-    query = f"title = '{folder_name}' and '{parent_folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-    folder_list = drive.ListFile({'q': query}).GetList()
+def get_or_create_folder(drive, parent_folder_id, folder_name, cache=None):
+    if cache is not None:
+        # Lookup and creation happen under the cache lock, so concurrent callers create one folder
+        with cache._lock:
+            folder_id = cache.get(parent_folder_id, folder_name)
+            if folder_id is None:
+                folder_id = get_or_create_folder(drive, parent_folder_id, folder_name)
+                cache.set(parent_folder_id, folder_name, folder_id)
+            return folder_id
+
+    query = f"title = '{folder_name}' and '{parent_folder_id}' in parents and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+    folder_list = with_retries(lambda: drive.ListFile({'q': query}).GetList())
 
     if len(folder_list) == 0:
         print(f"Creating {folder_name} folder...")
-        new_folder = create_folder(drive, parent_folder_id, folder_name)
+        new_folder = with_retries(lambda: create_folder(drive, parent_folder_id, folder_name))
         return new_folder['id']
     else:
         print(f"{folder_name} folder already exists.")
         return folder_list[0]['id']
 
+# Function to make a folder readable by anyone with the link; files inside inherit it
+def share_folder(drive, folder_id):
+    folder = drive.CreateFile({'id': folder_id})
+    with_retries(lambda: folder.InsertPermission({
+        'type': 'anyone',
+        'value': 'anyone',
+        'role': 'reader'
+    }))
+
 # Function to upload a file to Google Drive
-def upload_file_to_drive(drive, parent_folder_id, file_path, file_name):
+def upload_file_to_drive(drive, parent_folder_id, file_path, file_name, make_public=True, retries=5):
     gfile = drive.CreateFile({
         'title': file_name,
         'parents': [{'id': parent_folder_id}]
     })
-    gfile.SetContentFile(file_path)
-    gfile.Upload()
+
+    def upload():
+        # Reopen the content on every attempt, as a failed upload may have read part of it
+        gfile.SetContentFile(file_path)
+        gfile.Upload(param=_request_param(drive))
+
+    # Upload and sharing are retried separately, so a failed share doesn't upload a duplicate
+    with_retries(upload, retries)
     print(f"Uploaded {file_name} to folder ID {parent_folder_id}.")
 
-    gfile.InsertPermission({
-        'type': 'anyone',
-        'value': 'anyone',
-        'role': 'reader'
-    })
+    if make_public:
+        with_retries(lambda: gfile.InsertPermission({
+            'type': 'anyone',
+            'value': 'anyone',
+            'role': 'reader'
+        }), retries)
     public_id = gfile['id']
-    return public_id
\ No newline at end of file
+    return public_id
+
+# Function to upload many files concurrently, skipping those already in the ledger
+def batch_upload(drive, uploads, ledger_path=None, num_workers=8, retries=5, make_public=False):
+    """Upload (file_path, parent_folder_id, file_name) tuples on a thread pool.
+
+    Each Drive call is retried with backoff on transient errors. With a
+    ledger_path, finished uploads are recorded as they complete and skipped on
+    the next run. Files are not shared one by one unless make_public is set;
+    sharing their folder with share_folder covers them all in one call.
+    Returns {file_path: file_id}; files that still failed after all retries
+    are left out and reported.
+    """
+    ledger = UploadLedger(ledger_path) if ledger_path else None
+    file_ids = {}
+    pending = []
+    for file_path, parent_folder_id, file_name in uploads:
+        file_id = ledger.file_id(file_path, parent_folder_id) if ledger else None
+        if file_id is not None:
+            file_ids[file_path] = file_id
+        else:
+            pending.append((file_path, parent_folder_id, file_name))
+    print(f"Uploading {len(pending)} files, {len(file_ids)} already uploaded.")
+
+    def upload(file_path, parent_folder_id, file_name):
+        file_id = upload_file_to_drive(drive, parent_folder_id, file_path, file_name, make_public, retries)
+        if ledger is not None:
+            ledger.record(file_path, parent_folder_id, file_id)
+        return file_id
+
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(upload, *item): item[0] for item in pending}
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    file_ids[file_path] = future.result()
+                except Exception as e:
+                    print(f"Failed to upload {file_path}: {e}")
+                    failed.append(file_path)
+    finally:
+        if ledger is not None:
+            ledger.close()
+
+    print(f"Uploaded {len(pending) - len(failed)} files, {len(failed)} failed.")
+    return file_ids
+
+# Function to mirror a local directory tree into a Drive folder
+def upload_directory(drive, local_dir, parent_folder_id, ledger_path=None, folder_cache=None,
+                     num_workers=8, make_public=False):
+    """Upload every file under local_dir into matching subfolders of parent_folder_id."""
+    folder_cache = folder_cache if folder_cache is not None else FolderCache()
+    uploads = []
+    for subdir, _, files in os.walk(local_dir):
+        folder_id = parent_folder_id
+        relative = os.path.relpath(subdir, local_dir)
+        if relative != '.':
+            for folder_name in relative.split(os.sep):
+                folder_id = get_or_create_folder(drive, folder_id, folder_name, folder_cache)
+        for file in sorted(files):
+            uploads.append((os.path.join(subdir, file), folder_id, file))
+    return batch_upload(drive, uploads, ledger_path, num_workers, make_public=make_public)
@@ -0,0 +1,29 @@
+import os
+import json
+
+# Append-only JSON-lines files (manifests, shard indexes, upload ledgers) that
+# survive interrupted runs: a torn last line is skipped on reading, and
+# appending starts on a fresh line after it.
+
+def iter_jsonl(path):
+    """Yield the records of a JSON-lines file; lines that don't parse are skipped."""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def open_jsonl_for_append(path):
+    """Open a JSON-lines file for appending, starting on a fresh line if the last one is torn."""
+    torn = False
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b'\n'
+    file = open(path, 'a', encoding='utf-8')
+    if torn:
+        file.write('\n')
+    return file
@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from audio_io import convert_audio_file
+from audio_separation import AudioProcessor, ProcessingConfig
+from shards import ShardWriter
+from utils import is_up_to_date, wav_output_path
+from vad import VAD
+import asr_transcriber
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.m4a', '.ogg', '.opus')
+# Outputs of earlier runs that are stored next to their inputs
+DERIVED_SUFFIXES = ('_vocals.wav', '_only_speech.wav')
+
+# End-of-input marker passed down the stage queues
+_STOP = object()
+
+class Stage:
+    """One pipeline stage: a pool of worker threads reading from a bounded queue.
+
+    Each worker takes an item, runs fn on it and puts the result on the next
+    stage's queue (None results are dropped). The queues are bounded, so
+    when a stage falls behind, the stages feeding it block on put instead of
+    piling up work in memory.
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.input = queue.Queue(maxsize=queue_size)
+        self.next: Optional['Stage'] = None
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.logger = logging.getLogger(f'Pipeline.{name}')
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'{self.name}-{idx}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            item = self.input.get()
+            if item is _STOP:
+                # Leave the marker for the other workers of this stage
+                self.input.put(_STOP)
+                return
+
+            start_time = time.time()
+            try:
+                result = self.fn(item)
+            except Exception:
+                self.logger.exception(f"{self.name} failed on {item_label(item)}")
+                with self._lock:
+                    self.failed += 1
+                continue
+
+            with self._lock:
+                self.processed += 1
+                self.busy_seconds += time.time() - start_time
+            if result is not None and self.next is not None:
+                self.next.input.put(result)
+
+def item_label(item) -> str:
+    """Short description of a pipeline item for log messages."""
+    return item[0] if isinstance(item, tuple) else str(item)
+
+class Pipeline:
+    """Stages connected in order, all running at the same time."""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+
+    def run(self, items: Iterable):
+        for stage in self.stages:
+            stage.start()
+
+        for item in items:
+            self.stages[0].input.put(item)
+        self.stages[0].input.put(_STOP)
+
+        # A stage is done once all its workers saw the marker; then the next one may stop
+        for stage, next_stage in zip(self.stages, self.stages[1:] + [None]):
+            stage.join()
+            if next_stage is not None:
+                next_stage.input.put(_STOP)
+
+def find_audio_files(input_path: str) -> List[str]:
+    """List source recordings under input_path, skipping outputs of earlier runs.
+
+    A WAV next to a non-WAV recording of the same name is that recording's
+    conversion (by the convert stage or utils.py), so only the source is listed.
+    """
+    if os.path.isfile(input_path):
+        return [input_path]
+    audio_files = []
+    for subdir, _, files in os.walk(input_path):
+        for file in sorted(files):
+            if file.lower().endswith(AUDIO_EXTENSIONS) and not file.endswith(DERIVED_SUFFIXES):
+                audio_files.append(os.path.join(subdir, file))
+    converted = {wav_output_path(path) for path in audio_files if not path.lower().endswith('.wav')}
+    return [path for path in audio_files if path not in converted]
+
+def build_stages(args, processor: Optional[AudioProcessor], registry, manifest, shard_writer) -> List[Stage]:
+    """Create the convert, separate, VAD and transcribe stages for the parsed arguments."""
+    manifest_lock = threading.Lock()
+    local = threading.local()
+
+    def convert(path):
+        if path.lower().endswith('.wav'):
+            return path
+        output_path = wav_output_path(path)
+        if not is_up_to_date(path, output_path):
+            convert_audio_file(path, output_path, args.sample_rate, channels=1)
+        return output_path
+
+    def separate(path):
+        return processor.remove_background_music(path, args.mode)
+
+    def detect_speech(path):
+        # The torch VAD keeps its state inside the model, so each worker gets its own
+        if not hasattr(local, 'vad'):
+            local.vad = VAD(backend=args.vad_backend)
+        vad = local.vad
+        wav = vad.read_audio(path)
+        timestamps = vad.get_speech_timestamps(wav)
+        if shard_writer is not None:
+            vad.write_segments(wav, timestamps, shard_writer, os.path.splitext(path)[0])
+        return path, [(ts, wav[ts['start']:ts['end']]) for ts in timestamps]
+
+    def transcribe(item):
+        path, segments = item
+        for index, (ts, speech) in enumerate(segments):
+            record = {
+                "audio_filepath": path,
+                "segment": index,
+                "start": round(ts['start'] / asr_transcriber.SAMPLING_RATE, 3),
+                "end": round(ts['end'] / asr_transcriber.SAMPLING_RATE, 3),
+                "pred_text": asr_transcriber.transcribe_audio(speech, args.model, registry),
+                "model_name": args.model
+            }
+            with manifest_lock:
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                manifest.flush()
+
+    stages = [Stage('convert', convert, args.convert_workers, args.queue_size)]
+    if processor is not None:
+        stages.append(Stage('separate', separate, args.separate_workers, args.queue_size))
+    stages.append(Stage('vad', detect_speech, args.vad_workers, args.queue_size))
+    stages.append(Stage('transcribe', transcribe, args.asr_workers, args.queue_size))
+    return stages
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Convert, separate, segment and transcribe recordings with all stages running concurrently.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('input_path', help='Audio file or directory of recordings')
+    parser.add_argument('--model', choices=list(asr_transcriber.BACKENDS), required=True,
+                        help='ASR model for the transcribe stage')
+    parser.add_argument('--output', default='pipeline_manifest.jsonl', help='JSONL file receiving one line per speech segment')
+    parser.add_argument('--sample-rate', type=int, default=44100, help='Sample rate of converted WAV files')
+    parser.add_argument('--mode', choices=['spleeter', 'demucs'], default='demucs', help='Separation mode')
+    parser.add_argument('--no-separation', action='store_true', help='Skip background music removal')
+    parser.add_argument('--chunk-duration', type=float, default=5, help='Separation chunk duration in minutes')
+    parser.add_argument('--separation-processes', type=int, default=1, help='Chunk worker processes per separation')
+    parser.add_argument('--vad-backend', choices=['torch', 'onnx'], default='torch', help='VAD backend')
+    parser.add_argument('--shard-dir', default=None, help='Also pack speech segments into shards in this directory')
+    parser.add_argument('--convert-workers', type=int, default=2, help='Threads in the convert stage')
+    parser.add_argument('--separate-workers', type=int, default=1, help='Threads in the separate stage')
+    parser.add_argument('--vad-workers', type=int, default=2, help='Threads in the VAD stage')
+    parser.add_argument('--asr-workers', type=int, default=1, help='Threads in the transcribe stage')
+    parser.add_argument('--queue-size', type=int, default=4, help='Items buffered between two stages')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    audio_files = find_audio_files(args.input_path)
+    if not audio_files:
+        print(f"No audio files found in {args.input_path}", file=sys.stderr)
+        sys.exit(1)
+
+    processor = None
+    if not args.no_separation:
+        processor = AudioProcessor(ProcessingConfig(
+            chunk_duration_minutes=args.chunk_duration,
+            num_workers=args.separation_processes,
+            log_file=None
+        ))
+    registry = asr_transcriber.ModelRegistry()
+    shard_writer = ShardWriter(args.shard_dir) if args.shard_dir else None
+
+    start_time = time.time()
+    try:
+        with open(args.output, 'a', encoding='utf-8') as manifest:
+            stages = build_stages(args, processor, registry, manifest, shard_writer)
+            Pipeline(stages).run(audio_files)
+    finally:
+        if processor is not None:
+            processor.close()
+        if shard_writer is not None:
+            shard_writer.close()
+
+    total_time = time.time() - start_time
+    print("\nPipeline Summary:")
+    print(f"Total time: {total_time:.2f} seconds for {len(audio_files)} files")
+    for stage in stages:
+        print(f"- {stage.name}: {stage.processed} done, {stage.failed} failed, "
+              f"{stage.busy_seconds:.1f}s busy across {stage.workers} workers")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import os
+import json
+import glob
+import threading
+import wave
+import numpy as np
+from audio_io import float_to_pcm16
+from jsonl import iter_jsonl, open_jsonl_for_append
+
+INDEX_NAME = 'index.jsonl'
+SHARD_NAME = 'shard-{:05d}.pcm'
+# Frames copied at a time by ShardWriter.add_wav
+COPY_BLOCK_FRAMES = 1 << 16
+
+class ShardClipWriter:
+    """Appends one clip to the current shard; obtained from ShardWriter.open_clip.
+
+    Has the same ``write``/``close`` interface as audio_io.WavWriter, so stages
+    that stream their output can write into a shard the same way as into a WAV.
+    """
+
+    def __init__(self, shard_writer, utt_id, sample_rate, channels, meta):
+        self._shard_writer = shard_writer
+        self.utt_id = utt_id
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.meta = meta
+        self.num_frames = 0
+        self.offset = shard_writer._shard_file.tell()
+
+    def write(self, samples):
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[None, :]
+        if samples.shape[0] != self.channels:
+            raise ValueError(f"Expected {self.channels} channels, got {samples.shape[0]}")
+        self.write_pcm(float_to_pcm16(samples.T).tobytes())
+
+    def write_pcm(self, pcm):
+        """Append interleaved little-endian 16-bit PCM bytes as they are."""
+        self._shard_writer._shard_file.write(pcm)
+        self.num_frames += len(pcm) // (2 * self.channels)
+
+    def close(self):
+        """Record the clip in the index, making it visible to readers."""
+        self._shard_writer._finish_clip(self, {
+            'id': self.utt_id,
+            'shard': self._shard_writer._shard_name,
+            'offset': self.offset,
+            'num_frames': self.num_frames,
+            'channels': self.channels,
+            'sample_rate': self.sample_rate,
+            **self.meta
+        })
+
+    def abort(self):
+        """Drop the partially written clip."""
+        self._shard_writer._finish_clip(self, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class ShardWriter:
+    """Packs many clips into a few large shard files plus one offset index.
+
+    Shards hold raw interleaved 16-bit PCM back to back. ``index.jsonl`` gets
+    one line per finished clip with its shard, byte offset, length and any
+    extra metadata. Reopening a directory resumes it: existing clips are kept
+    (``utt_id in writer``) and new clips go into new shards.
+
+    One clip is written at a time; concurrent ``open_clip`` calls wait for it.
+    """
+
+    def __init__(self, shard_dir, max_shard_bytes=1 << 30):
+        self.shard_dir = shard_dir
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(shard_dir, exist_ok=True)
+        self.ids = set(read_index(shard_dir))
+        self._next_shard = len(glob.glob(os.path.join(shard_dir, SHARD_NAME.replace('{:05d}', '*'))))
+        self._index = open_jsonl_for_append(os.path.join(shard_dir, INDEX_NAME))
+        self._shard_file = None
+        self._shard_name = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, utt_id):
+        return utt_id in self.ids
+
+    def open_clip(self, utt_id, sample_rate, channels=1, **meta):
+        """Start streaming a clip into the current shard."""
+        self._lock.acquire()
+        try:
+            if self._shard_file is None or self._shard_file.tell() >= self.max_shard_bytes:
+                self._open_next_shard()
+            return ShardClipWriter(self, utt_id, sample_rate, channels, meta)
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def add(self, utt_id, samples, sample_rate, **meta):
+        """Write a whole mono or (channels, samples) float clip."""
+        samples = np.atleast_2d(samples)
+        with self.open_clip(utt_id, sample_rate, samples.shape[0], **meta) as clip:
+            clip.write(samples)
+        return utt_id
+
+    def add_wav(self, utt_id, wav_path, **meta):
+        """Copy a finished 16-bit PCM WAV file into the shard as one clip.
+
+        Lets slow producers write their own file first, so the shard is only
+        held for the copy.
+        """
+        with wave.open(str(wav_path), 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{wav_path} is not 16-bit PCM")
+            with self.open_clip(utt_id, wav.getframerate(), wav.getnchannels(), **meta) as clip:
+                while True:
+                    pcm = wav.readframes(COPY_BLOCK_FRAMES)
+                    if not pcm:
+                        break
+                    clip.write_pcm(pcm)
+        return utt_id
+
+    def close(self):
+        with self._lock:
+            if self._shard_file is not None:
+                self._shard_file.close()
+                self._shard_file = None
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _open_next_shard(self):
+        if self._shard_file is not None:
+            self._shard_file.close()
+        self._shard_name = SHARD_NAME.format(self._next_shard)
+        self._next_shard += 1
+        self._shard_file = open(os.path.join(self.shard_dir, self._shard_name), 'ab')
+
+    def _finish_clip(self, clip, record):
+        try:
+            if record is None:
+                self._shard_file.truncate(clip.offset)
+                self._shard_file.seek(clip.offset)
+                return
+            # Audio must be on disk before the index line that points at it
+            self._shard_file.flush()
+            self._index.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._index.flush()
+            self.ids.add(clip.utt_id)
+        finally:
+            self._lock.release()
+
+def read_index(shard_dir):
+    """Load index.jsonl as {utt_id: record}; later entries win, a torn last line is ignored."""
+    records = {}
+    for record in iter_jsonl(os.path.join(shard_dir, INDEX_NAME)):
+        records[record['id']] = record
+    return records
+
+class ShardReader:
+    """Random access to clips in a shard directory by utterance id.
+
+    Shards are memory-mapped, so ``get_pcm`` returns a zero-copy int16 view and
+    no per-clip file is ever opened. ``reader[utt_id]`` returns float32.
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        self.index = read_index(shard_dir)
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def get_pcm(self, utt_id):
+        """Return ``(pcm, sample_rate)`` with pcm an int16 (frames, channels) memmap view."""
+        record = self.index[utt_id]
+        start = record['offset'] // 2
+        end = start + record['num_frames'] * record['channels']
+        pcm = self._map(record['shard'], end)[start:end]
+        return pcm.reshape(-1, record['channels']), record['sample_rate']
+
+    def __getitem__(self, utt_id):
+        """Return ``(samples, sample_rate)`` as float32, mono ``(samples,)`` or ``(channels, samples)``."""
+        pcm, sample_rate = self.get_pcm(utt_id)
+        samples = pcm.T.astype(np.float32) / 32768.0
+        return (samples[0] if samples.shape[0] == 1 else samples), sample_rate
+
+    def _map(self, shard_name, min_length):
+        # Shards still being written can grow, so remap when a clip lies past the end
+        shard_map = self._maps.get(shard_name)
+        if shard_map is None or len(shard_map) < min_length:
+            shard_map = np.memmap(os.path.join(self.shard_dir, shard_name), dtype='<i2', mode='r')
+            self._maps[shard_name] = shard_map
+        return shard_map
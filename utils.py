@@ -1,38 +1,145 @@
 import os
+import json
+import time
 import argparse
-from pydub import AudioSegment
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from audio_io import convert_audio_file, load_audio
+from shards import ShardWriter
+
+# A WAV file no larger than its header holds no audio
+WAV_HEADER_BYTES = 44
+
+def wav_output_path(mp3_path):
+    """Output path with the same filename but a .wav extension."""
+    return os.path.splitext(mp3_path)[0] + ".wav"
+
+def is_up_to_date(mp3_path, output_path):
+    """Whether output_path holds audio and is not older than mp3_path."""
+    try:
+        source_stat = os.stat(mp3_path)
+        output_stat = os.stat(output_path)
+    except FileNotFoundError:
+        return False
+    return output_stat.st_size > WAV_HEADER_BYTES and output_stat.st_mtime >= source_stat.st_mtime
 
 def convert_mp3_to_mono_wav(mp3_path, target_sample_rate=44100):
-    # Load MP3 file
-    sound = AudioSegment.from_mp3(mp3_path)
-    
-    # Convert to mono and set the sample rate
-    sound = sound.set_channels(1)
-    sound = sound.set_frame_rate(target_sample_rate)
-    
     # Generate output path with same filename but .wav extension
-    output_path = os.path.splitext(mp3_path)[0] + ".wav"
-    
-    # Export the final audio file
-    sound.export(output_path, format="wav")
-    
-    return output_path
-
-def convert_directory_mp3_to_wav(root_dir, target_sample_rate=44100):
-    # Traverse the directory and its subdirectories
+    output_path = wav_output_path(mp3_path)
+
+    # Decode, downmix to mono and resample in a single ffmpeg pass. The WAV is
+    # renamed into place when complete, so an interrupted run never leaves a
+    # partial file that looks up to date
+    return convert_audio_file(mp3_path, output_path, target_sample_rate, channels=1)
+
+def convert_job(mp3_path, target_sample_rate=44100):
+    """Convert one file unless its WAV is up to date, returning a manifest record."""
+    output_path = wav_output_path(mp3_path)
+    record = {"source": mp3_path, "output": output_path}
+    if is_up_to_date(mp3_path, output_path):
+        record["status"] = "skipped"
+        return record
+
+    start_time = time.time()
+    try:
+        convert_mp3_to_mono_wav(mp3_path, target_sample_rate)
+        record["status"] = "converted"
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = str(e)
+    record["seconds"] = round(time.time() - start_time, 3)
+    return record
+
+def decode_job(mp3_path, target_sample_rate=44100):
+    """Decode one file to mono float32 for packing into a shard, returning (record, samples)."""
+    record = {"source": mp3_path}
+    samples = None
+    start_time = time.time()
+    try:
+        samples, _ = load_audio(mp3_path, target_sample_rate, channels=1)
+        record["status"] = "converted"
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = str(e)
+    record["seconds"] = round(time.time() - start_time, 3)
+    return record, samples
+
+def shard_utt_id(mp3_path, root_dir):
+    """Utterance id of a file inside a shard: its path relative to root_dir, without extension."""
+    return os.path.splitext(os.path.relpath(mp3_path, root_dir))[0]
+
+def iter_job_results(job, paths, target_sample_rate, num_workers=1):
+    """Run job over paths, in a process pool when num_workers > 1, yielding results in order."""
+    if num_workers <= 1:
+        yield from map(job, paths, repeat(target_sample_rate))
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        yield from executor.map(job, paths, repeat(target_sample_rate), chunksize=16)
+
+def find_mp3_files(root_dir):
+    """List all MP3 files in the directory and its subdirectories."""
+    mp3_files = []
     for subdir, _, files in os.walk(root_dir):
         for file in files:
-            # Process only MP3 files
             if file.endswith(".mp3"):
-                mp3_path = os.path.join(subdir, file)
-                print(f"Processing: {mp3_path}")
-                
-                # Convert the MP3 to mono WAV with the same name
-                output_wav_path = convert_mp3_to_mono_wav(mp3_path, target_sample_rate)
-                
-                print(f"Converted file saved at: {output_wav_path}")
-
-def process_input(path, target_sample_rate=44100):
+                mp3_files.append(os.path.join(subdir, file))
+    return mp3_files
+
+def convert_directory_mp3_to_wav(root_dir, target_sample_rate=44100, num_workers=1, manifest_path=None, shard_dir=None):
+    """Convert every MP3 under root_dir, skipping files whose WAV is already up to date.
+
+    With num_workers > 1, files are converted in a process pool. With a
+    manifest_path, one JSON line per file (source, output, status and time
+    taken) is appended as results come in. With a shard_dir, the decoded audio
+    is packed into shards (see shards.py) instead of written as loose WAVs,
+    and files already in the shard index are skipped.
+    """
+    mp3_files = find_mp3_files(root_dir)
+    print(f"Found {len(mp3_files)} MP3 files")
+    counts = {"converted": 0, "skipped": 0, "failed": 0}
+
+    writer = ShardWriter(shard_dir) if shard_dir else None
+    manifest = open(manifest_path, "a", encoding="utf-8") if manifest_path else None
+    try:
+        if writer is None:
+            records = iter_job_results(convert_job, mp3_files, target_sample_rate, num_workers)
+        else:
+            pending = [path for path in mp3_files if shard_utt_id(path, root_dir) not in writer]
+            counts["skipped"] += len(mp3_files) - len(pending)
+            records = _pack_into_shards(
+                iter_job_results(decode_job, pending, target_sample_rate, num_workers),
+                writer, root_dir, target_sample_rate
+            )
+
+        for record in records:
+            counts[record["status"]] += 1
+            if record["status"] == "converted":
+                print(f"Converted file saved at: {record['output']}")
+            elif record["status"] == "failed":
+                print(f"Failed to convert {record['source']}: {record['error']}")
+
+            if manifest is not None:
+                manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+                manifest.flush()
+    finally:
+        if writer is not None:
+            writer.close()
+        if manifest is not None:
+            manifest.close()
+
+    print(f"Converted: {counts['converted']}, up to date: {counts['skipped']}, failed: {counts['failed']}")
+    return counts
+
+def _pack_into_shards(results, writer, root_dir, target_sample_rate):
+    """Write decoded (record, samples) results into writer, yielding their manifest records."""
+    for record, samples in results:
+        if samples is not None:
+            utt_id = shard_utt_id(record["source"], root_dir)
+            writer.add(utt_id, samples, target_sample_rate, source=record["source"])
+            record["output"] = f"{writer.shard_dir}:{utt_id}"
+        yield record
+
+def process_input(path, target_sample_rate=44100, num_workers=1, manifest_path=None, shard_dir=None):
     """Determine if the input is a file or directory and process accordingly."""
     if os.path.isfile(path) and path.endswith(".mp3"):
         print(f"Processing file: {path}")
@@ -40,7 +147,7 @@ def process_input(path, target_sample_rate=44100):
         print(f"Converted file saved at: {output_path}")
     elif os.path.isdir(path):
         print(f"Processing directory: {path}")
-        convert_directory_mp3_to_wav(path, target_sample_rate)
+        convert_directory_mp3_to_wav(path, target_sample_rate, num_workers, manifest_path, shard_dir)
     else:
         print(f"Invalid input: {path}. Please provide a valid MP3 file or directory.")
 
@@ -52,9 +159,12 @@ if __name__ == "__main__":
     # Arguments for input path and sample rate
     parser.add_argument("input_path", type=str, help="The MP3 file or directory to convert.")
     parser.add_argument("--sample_rate", type=int, default=44100, help="The target sample rate for WAV files. Default is 44100 Hz.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of files converted in parallel. Default is 1.")
+    parser.add_argument("--manifest", type=str, default=None, help="Append a JSON line per converted file to this path.")
+    parser.add_argument("--shard-dir", type=str, default=None, help="Pack converted audio into shards in this directory instead of loose WAVs.")
 
     # Parse arguments
     args = parser.parse_args()
 
     # Process the input (either file or directory)
-    process_input(args.input_path, args.sample_rate)
\ No newline at end of file
+    process_input(args.input_path, args.sample_rate, args.workers, args.manifest, args.shard_dir)
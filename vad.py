@@ -1,31 +1,418 @@
-import silero_vad
+import importlib.util
+import math
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import numpy as np
+from audio_io import AudioSource, load_audio, write_wav
 
 
 SAMPLING_RATE = 16000
-USE_ONNX = False # change this to True if you want to test onnx model
+FRAME_SIZE = 512 # samples per Silero VAD window at 16 kHz
+CONTEXT_SIZE = 64 # samples of the previous window the ONNX model sees at 16 kHz
+
+def silero_onnx_path():
+    """Path of the ONNX model shipped with the silero_vad package, found without importing it (and torch)."""
+    spec = importlib.util.find_spec('silero_vad')
+    if spec is None:
+        raise ImportError("silero_vad is not installed")
+    return os.path.join(spec.submodule_search_locations[0], 'data', 'silero_vad.onnx')
+
+def create_onnx_session(model_path=None, intra_op_threads=1, inter_op_threads=1):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    return onnxruntime.InferenceSession(
+        model_path or silero_onnx_path(),
+        sess_options=options,
+        providers=['CPUExecutionProvider']
+    )
+
+# One session per model path and thread setting, shared by every VAD in the process
+_onnx_sessions = {}
+_onnx_sessions_lock = threading.Lock()
+
+def get_onnx_session(model_path=None, intra_op_threads=1, inter_op_threads=1):
+    """Return the process-wide shared session for these settings, creating it once."""
+    key = (model_path, intra_op_threads, inter_op_threads)
+    with _onnx_sessions_lock:
+        if key not in _onnx_sessions:
+            _onnx_sessions[key] = create_onnx_session(model_path, intra_op_threads, inter_op_threads)
+        return _onnx_sessions[key]
+
+class OnnxSessionPool:
+    """A fixed number of ONNX sessions, each used by one thread at a time.
+
+    Useful when many threads run VAD at once: every session keeps its own
+    intra-op thread budget instead of all threads contending for one session.
+    Worker processes should each build their own pool.
+    """
+
+    def __init__(self, size, model_path=None, intra_op_threads=1, inter_op_threads=1):
+        self._sessions = queue.Queue()
+        for _ in range(size):
+            self._sessions.put(create_onnx_session(model_path, intra_op_threads, inter_op_threads))
+
+    @contextmanager
+    def session(self):
+        session = self._sessions.get()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+class OnnxVADModel:
+    """Silero VAD on onnxruntime with NumPy in and out.
+
+    Same call interface as the torch model: ``model(frames, sr)`` scores one
+    (batch, FRAME_SIZE) window per row and ``reset_states`` starts new streams.
+    The recurrent state lives here, not in the session, so sessions can be shared.
+    """
+
+    def __init__(self, session=None, pool=None):
+        self.session = session
+        self.pool = pool
+        self.reset_states()
+
+    def reset_states(self, batch_size=1):
+        self._state = np.zeros((2, batch_size, 128), dtype=np.float32)
+        self._context = np.zeros((batch_size, CONTEXT_SIZE), dtype=np.float32)
+
+    def __call__(self, x, sr):
+        x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+        if self._state.shape[1] != x.shape[0]:
+            self.reset_states(x.shape[0])
+        inputs = {
+            'input': np.concatenate([self._context, x], axis=1),
+            'state': self._state,
+            'sr': np.array(sr, dtype=np.int64)
+        }
+        if self.pool is not None:
+            with self.pool.session() as session:
+                out, self._state = session.run(None, inputs)
+        else:
+            out, self._state = self.session.run(None, inputs)
+        self._context = inputs['input'][:, -CONTEXT_SIZE:]
+        return out
+
+def ms_to_frames(ms, sampling_rate=SAMPLING_RATE, frame_size=FRAME_SIZE):
+    """Number of whole VAD frames needed to cover ms milliseconds."""
+    return int(math.ceil(ms * sampling_rate / 1000 / frame_size))
+
+def probs_to_segments(probs, threshold=0.5, min_speech_duration_ms=250, min_silence_duration_ms=700,
+                      speech_pad_ms=30, num_samples=None, sampling_rate=SAMPLING_RATE, frame_size=FRAME_SIZE):
+    """Turn per-frame speech probabilities into ``[{'start': ..., 'end': ...}]`` sample timestamps.
+
+    Everything is vectorized with NumPy:
+
+    1. hysteresis: speech starts at ``threshold`` and only ends below ``threshold - 0.15``,
+    2. speech runs separated by less than ``min_silence_duration_ms`` are merged,
+    3. merged runs shorter than ``min_speech_duration_ms`` are dropped,
+    4. segments are padded by ``speech_pad_ms`` without overlapping each other.
+    """
+    probs = np.asarray(probs, dtype=np.float32)
+    if num_samples is None:
+        num_samples = len(probs) * frame_size
+    neg_threshold = max(threshold - 0.15, 0.01)
+
+    # Carry the last decisive frame forward over the frames in between the thresholds
+    events = np.where(probs >= threshold, 1, np.where(probs < neg_threshold, -1, 0))
+    last_event = np.maximum.accumulate(np.where(events != 0, np.arange(len(events)), -1))
+    speech = (last_event >= 0) & (events[last_event] == 1)
+
+    edges = np.diff(np.concatenate([[0], speech.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    if len(starts):
+        keep_gap = (starts[1:] - ends[:-1]) >= ms_to_frames(min_silence_duration_ms, sampling_rate, frame_size)
+        starts = np.concatenate([starts[:1], starts[1:][keep_gap]])
+        ends = np.concatenate([ends[:-1][keep_gap], ends[-1:]])
+
+    long_enough = (ends - starts) >= ms_to_frames(min_speech_duration_ms, sampling_rate, frame_size)
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    pad = int(sampling_rate * speech_pad_ms / 1000)
+    start_samples = np.maximum(starts * frame_size - pad, 0)
+    end_samples = np.minimum(ends * frame_size + pad, num_samples)
+    start_samples[1:] = np.maximum(start_samples[1:], end_samples[:-1])
+    return [{'start': int(start), 'end': int(end)} for start, end in zip(start_samples, end_samples)]
 
 class VAD:
-    def __init__(self):
-        self.model = silero_vad.load_silero_vad(onnx=USE_ONNX)
+    """Silero VAD with a selectable backend.
+
+    ``backend='torch'`` loads the TorchScript model through silero_vad.
+    ``backend='onnx'`` runs the packaged ONNX model on onnxruntime without
+    importing torch. It uses the process-wide shared session for the given
+    thread counts, or sessions from ``session_pool`` when one is passed.
+    """
+
+    def __init__(self, backend='torch', intra_op_threads=1, inter_op_threads=1, session_pool=None, onnx_path=None):
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f"Unknown VAD backend: {backend}")
+        self.backend = backend
+        if backend == 'onnx':
+            session = None if session_pool else get_onnx_session(onnx_path, intra_op_threads, inter_op_threads)
+            self.model = OnnxVADModel(session, session_pool)
+        else:
+            import silero_vad
+            self.model = silero_vad.load_silero_vad(onnx=False)
         self.sampling_rate = SAMPLING_RATE
         self.threshold = 0.5
         self.min_speech_duration_ms = 250
         self.min_silence_duration_ms = 700
+        self.speech_pad_ms = 30
+
+    def read_audio(self, path, cache_dir=None):
+        """Decode any audio file to a mono float32 array at the VAD sampling rate in one ffmpeg pass.
+
+        With a cache_dir, the decode is kept there as an audio_io.AudioSource and
+        a read-only memmap of it is returned, so slicing segments out of a long
+        recording copies nothing and other processes reuse the same decode.
+        """
+        if cache_dir is not None:
+            return AudioSource(path, self.sampling_rate, channels=1, cache_dir=cache_dir).samples
+        wav, _ = load_audio(path, self.sampling_rate, channels=1)
+        return wav
 
     def get_speech_timestamps(self, wav):
-        timestamps = silero_vad.get_speech_timestamps(wav, 
-                                       self.model, 
+        if self.backend == 'onnx':
+            return self.get_speech_timestamps_batch([wav])[0]
+
+        import silero_vad
+        import torch
+        if isinstance(wav, np.ndarray):
+            wav = torch.from_numpy(wav)
+        timestamps = silero_vad.get_speech_timestamps(wav,
+                                       self.model,
                                        sampling_rate=self.sampling_rate,
                                        threshold=self.threshold,
                                        min_speech_duration_ms=self.min_speech_duration_ms,
-                                       min_silence_duration_ms=self.min_silence_duration_ms
+                                       min_silence_duration_ms=self.min_silence_duration_ms,
+                                       speech_pad_ms=self.speech_pad_ms
                                        )
         return timestamps
-    
-    def collect_chunks(self, wav, timestamps, audio_path, extension='_only_speech.wav'):
+
+    def speech_probs_batch(self, wavs):
+        """Per-frame speech probabilities for several waveforms, computed together.
+
+        The waveforms are zero-padded to a common number of frames and every model
+        call scores one frame of each of them, so the model runs once per frame
+        position instead of once per frame per file.
+        """
+        num_frames = [int(math.ceil(len(wav) / FRAME_SIZE)) for wav in wavs]
+        batch = np.zeros((len(wavs), max(num_frames, default=0) * FRAME_SIZE), dtype=np.float32)
+        for row, wav in enumerate(wavs):
+            batch[row, :len(wav)] = np.asarray(wav, dtype=np.float32)
+
+        probs = np.zeros((len(wavs), batch.shape[1] // FRAME_SIZE), dtype=np.float32)
+        self.model.reset_states()
+        for frame in range(probs.shape[1]):
+            probs[:, frame] = self._score_frames(batch[:, frame * FRAME_SIZE:(frame + 1) * FRAME_SIZE])
+        self.model.reset_states()
+        return [probs[row, :frames] for row, frames in enumerate(num_frames)]
+
+    def _score_frames(self, frames, model=None):
+        """Speech probability of each row of a (batch, FRAME_SIZE) array, continuing the model state."""
+        model = model or self.model
+        if self.backend == 'onnx':
+            return model(frames, self.sampling_rate).reshape(-1)
+
+        import torch
+        with torch.no_grad():
+            return model(torch.from_numpy(frames), self.sampling_rate).numpy().reshape(-1)
+
+    def stream(self):
+        """Start a StreamingVAD using this VAD's model and parameters.
+
+        ONNX streams get their own state over the shared session, so any number
+        can run at once. The torch model keeps its state internally, so a torch
+        VAD can serve one stream at a time.
+        """
+        if self.backend == 'onnx':
+            return StreamingVAD(self, OnnxVADModel(self.model.session, self.model.pool))
+        return StreamingVAD(self, self.model)
+
+    def get_speech_timestamps_batch(self, wavs, batch_size=64, max_batch_seconds=1800.0):
+        """Speech timestamps for many 16 kHz waveforms, in the same order as ``wavs``.
+
+        Waveforms are grouped by length so batches carry little padding. A batch
+        holds at most batch_size waveforms and, once padded to its longest one,
+        at most max_batch_seconds of audio, so long recordings go in small
+        batches (a single longer one gets a batch of its own).
+        """
+        timestamps = [None] * len(wavs)
+        order = sorted(range(len(wavs)), key=lambda idx: len(wavs[idx]))
+        max_batch_samples = max_batch_seconds * self.sampling_rate
+        batches, batch = [], []
+        for idx in order:
+            # Lengths are ascending, so the new waveform sets the padded length
+            if batch and (len(batch) == batch_size or len(wavs[idx]) * (len(batch) + 1) > max_batch_samples):
+                batches.append(batch)
+                batch = []
+            batch.append(idx)
+        if batch:
+            batches.append(batch)
+
+        for batch in batches:
+            for idx, probs in zip(batch, self.speech_probs_batch([wavs[idx] for idx in batch])):
+                timestamps[idx] = probs_to_segments(
+                    probs,
+                    threshold=self.threshold,
+                    min_speech_duration_ms=self.min_speech_duration_ms,
+                    min_silence_duration_ms=self.min_silence_duration_ms,
+                    speech_pad_ms=self.speech_pad_ms,
+                    num_samples=len(wavs[idx]),
+                    sampling_rate=self.sampling_rate
+                )
+        return timestamps
+
+    def collect_chunks(self, wav, timestamps, audio_path, extension='_only_speech.wav', writer=None):
+        """Join the speech segments of wav and save them next to audio_path.
+
+        With a shards.ShardWriter, the speech goes into the shard under the id
+        the file would have had instead, and that id is returned as the path.
+        """
+        new_path = f'{os.path.splitext(audio_path)[0]}{extension}'
+        if writer is not None:
+            wav = np.asarray(wav, dtype=np.float32)
+            chunks = np.concatenate([wav[ts['start']:ts['end']] for ts in timestamps] or [wav[:0]])
+            writer.add(new_path, chunks, self.sampling_rate, source=audio_path)
+            return chunks, new_path
+
+        if self.backend == 'onnx':
+            wav = np.asarray(wav, dtype=np.float32)
+            chunks = np.concatenate([wav[ts['start']:ts['end']] for ts in timestamps] or [wav[:0]])
+            write_wav(new_path, chunks, self.sampling_rate)
+            return chunks, new_path
+
+        import silero_vad
+        import torch
+        if isinstance(wav, np.ndarray):
+            wav = torch.from_numpy(wav)
         chunks = silero_vad.collect_chunks(timestamps, wav)
-        new_path = f'{audio_path.split(".")[0]}{extension}'
         silero_vad.save_audio(new_path, chunks, self.sampling_rate)
         return chunks, new_path
-        
 
+    def write_segments(self, wav, timestamps, writer, utt_prefix):
+        """Write each speech segment to a shards.ShardWriter as its own clip.
+
+        Clips are named ``{utt_prefix}_{index:05d}`` and keep their position in
+        the source as ``start``/``end`` sample metadata. Returns the clip ids.
+        """
+        wav = np.asarray(wav, dtype=np.float32)
+        utt_ids = []
+        for index, ts in enumerate(timestamps):
+            utt_id = f'{utt_prefix}_{index:05d}'
+            writer.add(utt_id, wav[ts['start']:ts['end']], self.sampling_rate, start=ts['start'], end=ts['end'])
+            utt_ids.append(utt_id)
+        return utt_ids
+
+class StreamingVAD:
+    """Incremental speech segmentation of live 16 kHz audio.
+
+    ``process`` accepts audio of any length, keeps the model's hidden state
+    between calls and returns ``{'start': sample}`` / ``{'end': sample}`` events
+    as soon as they are certain. A start is reported once ``min_speech_duration_ms``
+    of speech has been seen and an end once ``min_silence_duration_ms`` of silence
+    has followed it, so latency and memory are bounded by those settings.
+
+    The rules are exactly those of ``probs_to_segments``, so after ``finish`` the
+    events describe the same segments as ``VAD.get_speech_timestamps_batch`` run
+    on the whole recording.
+    """
+
+    def __init__(self, vad, model):
+        self.vad = vad
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        self.model.reset_states()
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._num_samples = 0
+        self._frame = 0
+        self._speech = False
+        self._segment_start = None
+        self._last_off = None
+        self._started = False
+        self._last_end = 0
+
+    def process(self, audio):
+        """Feed the next samples of the stream and return the events they complete."""
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        self._num_samples += len(audio)
+        self._buffer = np.concatenate([self._buffer, audio])
+        num_frames = len(self._buffer) // FRAME_SIZE
+        frames = self._buffer[:num_frames * FRAME_SIZE].reshape(num_frames, FRAME_SIZE)
+        self._buffer = self._buffer[num_frames * FRAME_SIZE:]
+
+        events = []
+        for frame in frames:
+            events.extend(self._step(self.vad._score_frames(frame[None, :], self.model)[0]))
+        return events
+
+    def finish(self):
+        """Flush the stream, zero-padding its last partial frame, and close any open segment."""
+        events = []
+        if len(self._buffer):
+            frame = np.zeros(FRAME_SIZE, dtype=np.float32)
+            frame[:len(self._buffer)] = self._buffer
+            self._buffer = np.zeros(0, dtype=np.float32)
+            events.extend(self._step(self.vad._score_frames(frame[None, :], self.model)[0]))
+
+        if self._started:
+            end_frame = self._frame if self._last_off is None else self._last_off
+            events.append(self._end_event(end_frame, clip=True))
+        self._segment_start = self._last_off = None
+        self._started = False
+        return events
+
+    def _step(self, prob):
+        vad = self.vad
+        frame = self._frame
+        self._frame += 1
+        events = []
+
+        # Same hysteresis as probs_to_segments
+        if prob >= vad.threshold:
+            speech = True
+        elif prob < max(vad.threshold - 0.15, 0.01):
+            speech = False
+        else:
+            speech = self._speech
+
+        if speech and not self._speech:
+            # A pending segment still open here is less than min_silence away, so merge into it
+            if self._segment_start is None:
+                self._segment_start = frame
+            self._last_off = None
+        elif self._speech and not speech:
+            self._last_off = frame
+        self._speech = speech
+
+        if speech and not self._started and frame + 1 - self._segment_start >= ms_to_frames(vad.min_speech_duration_ms):
+            self._started = True
+            start = max(self._segment_start * FRAME_SIZE - self._pad(), self._last_end, 0)
+            events.append({'start': int(start)})
+
+        if not speech and self._last_off is not None and frame + 1 - self._last_off >= ms_to_frames(vad.min_silence_duration_ms):
+            if self._started:
+                events.append(self._end_event(self._last_off))
+            # Segments that never reached min_speech are dropped without events
+            self._segment_start = self._last_off = None
+            self._started = False
+        return events
+
+    def _end_event(self, end_frame, clip=False):
+        end = end_frame * FRAME_SIZE + self._pad()
+        if clip:
+            end = min(end, self._num_samples)
+        self._last_end = end
+        return {'end': int(end)}
+
+    def _pad(self):
+        return int(self.vad.sampling_rate * self.vad.speech_pad_ms / 1000)